@@ -0,0 +1,87 @@
+# Copyright: 2007-2013, Sebastian Billaudelle <sbillaudelle@googlemail.com>
+#            2010-2013, Kristoffer Kleine <kris.kleine@yahoo.de>
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Microbenchmark of reading and writing `cream.config.Configuration` values,
+comparing cached reads (plain attribute lookups) with reads through
+`Configuration.__getattr__`, the path every read took before values were
+cached.
+
+Usage: python benchmarks/config_access.py [NUMBER]
+"""
+
+import sys
+import shutil
+import tempfile
+import timeit
+
+OPTIONS = 50
+
+SCHEME = '<configuration>%s<static_option type="char" static="true">x</static_option></configuration>' % ''.join(
+    '<option%d type="integer" label="Option %d">%d</option%d>' % (i, i, i, i)
+    for i in range(OPTIONS))
+
+
+def measure(statement, setup, number):
+    """ Returns the number of executions of `statement` per second. """
+    return number / min(timeit.repeat(statement, setup, repeat=3, number=number))
+
+
+def main(args):
+
+    number = int(args[0]) if args else 200000
+
+    from cream.config import Configuration, ConfigurationProfile
+
+    directory = tempfile.mkdtemp()
+    try:
+        scheme_path = directory + '/scheme.xml'
+        with open(scheme_path, 'w') as f:
+            f.write(SCHEME)
+        config = Configuration(scheme_path, directory + '/configuration/')
+        # The default profile is not editable.
+        config.profiles.add(ConfigurationProfile('Benchmark', {},
+                                                 defaults=config.profiles.default.values))
+        config.use_profile(1)
+
+        namespace = {'config': config, 'Configuration': Configuration}
+        setup = 'from __main__ import config, Configuration'
+        globals().update(namespace)
+
+        results = [
+            ('read (cached)',
+                measure('config.option7', setup, number)),
+            ('read static (cached)',
+                measure('config.static_option', setup, number)),
+            ('read via __getattr__',
+                measure("Configuration.__getattr__(config, 'option7')", setup, number)),
+            ('write',
+                measure('config.option7 = 8; config.option7 = 7', setup, number // 10) * 2),
+            ('write + read',
+                measure('config.option7 = 8; config.option7', setup, number // 10)),
+        ]
+    finally:
+        shutil.rmtree(directory)
+
+    for name, per_second in results:
+        print '%-24s %12.0f per second' % (name, per_second)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,134 @@
+# Copyright: 2007-2013, Sebastian Billaudelle <sbillaudelle@googlemail.com>
+#            2010-2013, Kristoffer Kleine <kris.kleine@yahoo.de>
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Import time regression check for the parts of cream used by headless
+services. Every module is imported in a fresh interpreter, which records
+the self and cumulative time of each import (like `python3 -X importtime`).
+Exits with status 1 if a module exceeds its budget or pulls in GTK,
+GObject, D-Bus or gpyconf.
+
+Usage: python benchmarks/importtime.py [-v] [--scale FACTOR]
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+# Cumulative import time budgets in milliseconds.
+BUDGETS = {
+    'cream'                  : 5,
+    'cream.path'             : 10,
+    'cream.util.xmlserialize': 60,
+    'cream.manifest'         : 60,
+    'cream.dependencies'     : 60,
+    'cream.features'         : 60,
+    'cream.base'             : 60,
+}
+
+# Packages which must not be imported by any of the modules above.
+FORBIDDEN = ('gi', 'gtk', 'gobject', 'dbus', 'gpyconf', 'cairo')
+
+
+def trace_imports(module):
+    """ Imports `module` and returns `(name, depth, self, cumulative)` tuples. """
+
+    import __builtin__
+
+    original_import = __builtin__.__import__
+    imports = []
+    stack = []
+
+    def timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+        package = (globals or {}).get('__package__') or (globals or {}).get('__name__')
+        if name in sys.modules or (package and '%s.%s' % (package, name) in sys.modules):
+            return original_import(name, globals, locals, fromlist, level)
+
+        entry = [name, len(stack), 0.0, 0.0]
+        imports.append(entry)
+        stack.append(0.0)
+        start = time.time()
+        try:
+            return original_import(name, globals, locals, fromlist, level)
+        finally:
+            cumulative = time.time() - start
+            children = stack.pop()
+            entry[2], entry[3] = cumulative - children, cumulative
+            if stack:
+                stack[-1] += cumulative
+
+    __builtin__.__import__ = timed_import
+    try:
+        __import__(module)
+    finally:
+        __builtin__.__import__ = original_import
+
+    return imports, sorted(sys.modules)
+
+
+def run_child(module):
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--child', module],
+        stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        raise RuntimeError("Importing %s failed" % module)
+    return json.loads(output)
+
+
+def main(args):
+
+    if args[:1] == ['--child']:
+        imports, modules = trace_imports(args[1])
+        json.dump({'imports': imports, 'modules': modules}, sys.stdout)
+        return 0
+
+    verbose = '-v' in args
+    scale = float(args[args.index('--scale') + 1]) if '--scale' in args else 1.0
+
+    failures = 0
+    for module, budget in sorted(BUDGETS.items()):
+        result = run_child(module)
+        imports = result['imports']
+
+        if verbose:
+            print 'import time: self [us] | cumulative | imported package'
+            for name, depth, self_time, cumulative in imports:
+                print 'import time: %9d | %10d | %s%s' % (
+                    self_time * 1e6, cumulative * 1e6, '  ' * depth, name)
+
+        total = sum(entry[3] for entry in imports if entry[1] == 0) * 1000
+        forbidden = sorted(name for name in result['modules']
+                           if name.split('.')[0] in FORBIDDEN)
+
+        status = 'ok'
+        if total > budget * scale:
+            status = 'OVER BUDGET'
+        if forbidden:
+            status = 'IMPORTS %s' % ', '.join(forbidden)
+        if status != 'ok':
+            failures += 1
+
+        print '%-24s %7.2f ms  (budget %5.1f ms)  %s' % (module, total, budget * scale, status)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,83 @@
+# Copyright: 2007-2013, Sebastian Billaudelle <sbillaudelle@googlemail.com>
+#            2010-2013, Kristoffer Kleine <kris.kleine@yahoo.de>
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Memory benchmark comparing 5,000 slotted `cream.manifest.Manifest` records
+with the `dict` based manifests keeping their lxml tree alive, which were
+used previously.
+
+Usage: python benchmarks/manifest_memory.py [COUNT]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+from cream.manifest import Manifest
+
+from manifest_parser import MANIFEST, LegacyManifest
+
+
+def rss():
+    """ Returns the resident set size of this process in KiB. """
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+def measure(cls, paths):
+    """
+    Returns the memory used by instances of `cls` for all `paths`, measured
+    in a forked child process so results don't influence each other.
+    """
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        before = rss()
+        manifests = [cls(path) for path in paths]
+        os.write(write_fd, str(rss() - before))
+        os._exit(0)
+
+    os.close(write_fd)
+    result = int(os.read(read_fd, 64))
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    return result
+
+
+def main(count=5000):
+
+    directory = tempfile.mkdtemp()
+    paths = []
+    for i in xrange(count):
+        path = os.path.join(directory, str(i), 'manifest.xml')
+        os.mkdir(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(MANIFEST.replace('.Benchmark', '.Benchmark%d' % i))
+        paths.append(path)
+
+    try:
+        for cls in (LegacyManifest, Manifest):
+            print '%-15s %8d KiB for %d manifests' % (cls.__name__, measure(cls, paths), count)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
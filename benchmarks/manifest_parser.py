@@ -0,0 +1,256 @@
+# Copyright: 2007-2013, Sebastian Billaudelle <sbillaudelle@googlemail.com>
+#            2010-2013, Kristoffer Kleine <kris.kleine@yahoo.de>
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+Microbenchmark comparing the single-pass `cream.manifest.Manifest` parser
+with the previous implementation, which walked the component node once per
+section.
+
+Usage: python benchmarks/manifest_parser.py [NUMBER]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import timeit
+
+from lxml.etree import parse as parse_xml_file
+
+from cream.manifest import Manifest, ManifestException, NoNamespaceDefinedException
+
+
+MANIFEST = '''<?xml version="1.0" encoding="UTF-8"?>
+<manifest namespace="org.cream">
+    <component id=".Benchmark" type=".Module" name="Benchmark" version="0.1" exec="src/benchmark.py">
+        <license title="GPL" version="2.0" />
+        <icon path="src/data/icon.svg" />
+        <category id=".Utilities" />
+        <category id="org.freedesktop.System" />
+        <description lang="en" content="A module used for benchmarking the manifest parser." />
+        <description lang="de" content="Ein Modul zum Messen des Manifest-Parsers." />
+        <author name="Jane Doe" type="developer" mail="jane@example.org" />
+        <author name="John Doe" type="designer" mail="john@example.org" />
+        <use-feature id=".config" />
+        <use-feature id=".hotkeys" />
+        <use-feature id=".extensions" directory="extensions" />
+        <dependency id=".Dependency" type=".Library" required="true" />
+        <dependency id="org.example.Optional" type="org.example.Service" required="false" />
+        <provide-component type=".Extension" />
+    </component>
+    <package auto="true">
+        <rule type="ignore" files="*.pyc" />
+        <rule type="application" files="src/*.py" />
+        <rule type="icon" files="src/data/*.svg" />
+    </package>
+</manifest>
+'''
+
+
+class LegacyManifest(dict):
+    """ The multi-pass parser formerly used by `Manifest`. """
+
+    def __init__(self, path, expand_paths=True):
+
+        dict.__init__(self)
+
+        self._path = path
+        self._tree = parse_xml_file(self._path)
+
+        self['path'] = os.path.dirname(os.path.abspath(path))
+
+        root = self._tree.getroot()
+        if root.tag != 'manifest':
+            raise ManifestException("Manifest root tag has to 'manifest'")
+
+        namespaces = []
+
+        def append_ns(e):
+            if e.get('namespace'):
+                namespaces.append(e.get('namespace'))
+
+        def remove_ns(e):
+            if e.get('namespace'):
+                namespaces.remove(e.get('namespace'))
+
+        def expand_ns(s):
+            if s.startswith('.'):
+                if len(namespaces):
+                    return namespaces[-1] + s
+                else:
+                    raise NoNamespaceDefinedException
+            else:
+                return s
+
+        def expand_path(p):
+            if expand_paths:
+                if p:
+                    return os.path.join(os.path.dirname(self._path), p)
+            else:
+                return p
+
+        # TODO: Use a bottom-down iteration here and lookup node handlers
+        # from a dict or so. Much faster!
+
+        append_ns(root)
+
+        component = root.find('component')
+        append_ns(component)
+
+        # General meta information:
+        self['id'] = expand_ns(component.get('id'))
+        self['type'] = expand_ns(component.get('type'))
+        self['name'] = component.get('name')
+        self['version'] = component.get('version')
+        self['exec'] = component.get('exec')
+
+        # Licenses:
+        self['licenses'] = []
+
+        licenses = component.findall('license')
+        for license in licenses:
+            append_ns(license)
+            self['licenses'].append({
+                'title'   : license.get('title'),
+                'version' : license.get('version')
+            })
+            remove_ns(license)
+
+        # Icon:
+        icon = component.find('icon')
+        if icon is not None:
+            append_ns(icon)
+            self['icon'] = expand_path(icon.get('path'))
+            remove_ns(icon)
+
+        # Category
+        self['categories'] = []
+
+        categories = component.findall('category')
+        for category in categories:
+            append_ns(category)
+            self['categories'].append({
+                'id'  : expand_ns(category.get('id'))
+            })
+            remove_ns(category)
+
+        # Descriptions:
+        self['descriptions'] = {}
+
+        descriptions = component.findall('description')
+        for descr in descriptions:
+            append_ns(descr)
+            self['descriptions'][descr.get('lang')] = descr.get('content')
+            remove_ns(descr)
+
+        self['description'] = self['descriptions'].get('en') or ''
+
+        # Authors:
+        self['authors'] = []
+
+        authors = component.findall('author')
+        for author in authors:
+            append_ns(author)
+            self['authors'].append({
+                'name': author.get('name'),
+                'type': author.get('type'),
+                'mail': author.get('mail')
+                })
+            remove_ns(author)
+
+        # Features:
+        self['features'] = []
+
+        features = component.findall('use-feature')
+        for feature in features:
+            append_ns(feature)
+            feature_args = {}
+
+            for k, v in feature.attrib.iteritems():
+                if not k in ['id']:
+                    feature_args[k] = v
+            self['features'].append(
+                (expand_ns(feature.attrib.pop('id')), feature_args)
+            )
+            remove_ns(feature)
+
+        # Dependencies:
+        self['dependencies'] = []
+
+        dependencies = component.findall('dependency')
+        for dependency in dependencies:
+            append_ns(dependency)
+            self['dependencies'].append({
+                'id'        : expand_ns(dependency.get('id')),
+                'type'      : expand_ns(dependency.get('type')),
+                'required'  : dependency.get('required')
+                })
+            remove_ns(dependency)
+
+        # Provided component types:
+        self['provided-components'] = []
+
+        provided_components = component.findall('provide-component')
+        for component in provided_components:
+            append_ns(component)
+            self['provided-components'].append(expand_ns(component.get('type')))
+            remove_ns(component)
+
+
+        # Package information:
+        package = root.find('package')
+        if package is None:
+            return
+
+        self['package'] = {}
+
+        self['package']['auto'] = package.get('auto') == 'true'
+
+        self['package']['rules'] = {
+            'ignore': [],
+            'application': [],
+            'desktop': [],
+            'icon': [],
+            'library': [],
+        }
+
+        rules = package.findall('rule')
+        for rule in rules:
+            type  = rule.get('type')
+            files = rule.get('files')
+            self['package']['rules'][type].append(files)
+
+
+def main(number=2000):
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'manifest.xml')
+    with open(path, 'w') as f:
+        f.write(MANIFEST)
+
+    try:
+        assert dict(LegacyManifest(path)) == dict(Manifest(path))
+
+        for cls in (LegacyManifest, Manifest):
+            best = min(timeit.repeat(lambda: cls(path), repeat=3, number=number))
+            print '%-15s %8.1f us/manifest' % (cls.__name__, best / number * 1e6)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
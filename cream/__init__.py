@@ -15,87 +15,33 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import os
-import signal
-
-from cream.util import cached_property
-from cream.util import unique
-
-from .base import Component
-from .path import CREAM_DATA_DIRS
-
-class Module(Component, unique.UniqueApplication):
-    """
-    This is the baseclass for every Cream module. It bundles features
-    you would need within your application or service, such as:
-
-     - an GObject mainloop,
-     - logging capabilities,
-     - and meta data handling.
-
-    """
-
-    def __init__(self, module_id, module_name='', *args, **kwargs):
-
-        manifest_path = ''
-
-        for directory in CREAM_DATA_DIRS:
-            for sub_dir in (module_id, module_name):
-                path = os.path.join(directory, sub_dir, 'manifest.xml')
-                if os.path.exists(path):
-                    manifest_path = path
-                    break
-
-        Component.__init__(self, manifest_path, *args, **kwargs)
-        unique.UniqueApplication.__init__(self, module_id)
-
-
-    def main(self, enable_threads=True):
-        """
-        Run a GObject-mainloop.
-
-        :param enable_threads: Whether to enable GObjects threading
-                               capabilities. This can have negative
-                               impact on some applications. Please use
-                               with care!
-        :type enable_threads: `bool`
-        """
-
-        signal.signal(signal.SIGTERM, self.signal_cb)
-
-        from gi.repository import GObject as gobject
-
-        if enable_threads:
-            gobject.threads_init()
-
-        self._mainloop = gobject.MainLoop()
-        try:
-            self._mainloop.run()
-        except (SystemError, KeyboardInterrupt):
-            # shut down gracefully.
-            self.quit()
-
-
-    @cached_property
-    def messages(self):
-        from cream.log import Messages
-        return Messages(id=self.context.manifest['id'])
-
-
-    def signal_cb(self, signal, frame):
-        if signal == signal.SIGTERM:
-            self.quit()
-
-
-    def quit(self):
-        """ Quit the mainloop and exit the application. """
-
-        self.messages.debug("Shutting down quietly. Protesting wouldn't make sense. I'm just a machine. Grrrrmmm.")
-
-        unique.UniqueApplication.quit(self)
-
-        # __finalize__ all registered features:
-        for feature in self._features:
-            feature.__finalize__()
-
-        self._mainloop.quit()
+"""
+    Importing `cream` (e.g. for `cream.manifest`) is cheap: `cream.Module`,
+    which needs GObject, and the other names below are only imported on
+    first access.
+"""
+
+import sys
+import types
+
+# Maps names exported by this package to the modules defining them:
+_LAZY_EXPORTS = {
+    'Module'          : 'cream.module',
+    'Component'       : 'cream.base',
+    'CREAM_DATA_DIRS' : 'cream.path',
+}
+
+class _CreamPackage(types.ModuleType):
+
+    def __getattr__(self, name):
+        if name in _LAZY_EXPORTS:
+            value = getattr(__import__(_LAZY_EXPORTS[name], fromlist=[name]), name)
+            setattr(self, name, value)
+            return value
+        raise AttributeError("'module' object has no attribute '%s'" % name)
+
+# Keep a reference to the original module, Python 2 clears the globals of
+# modules being garbage collected.
+_package = sys.modules[__name__]
+sys.modules[__name__] = _CreamPackage(__name__, __doc__)
+sys.modules[__name__].__dict__.update(_package.__dict__)
@@ -18,10 +18,11 @@
 import os
 
 from cream.util import get_source_file
+from cream.util import trace
 
 from .manifest import Manifest
-from .features import FEATURES, NoSuchFeature
-from .path import CREAM_DATA_HOME, CREAM_DATA_DIR, VIRTUALENV_DATA_HOME
+from .features import FEATURES, NoSuchFeature, load_features_concurrently
+from .path import CREAM_DATA_HOME, CREAM_DATA_DIR, VIRTUALENV_DATA_HOME, ensure_directory
 
 
 class Context(object):
@@ -33,7 +34,8 @@ class Context(object):
 
         self.environ = os.environ
         self.working_directory = os.path.dirname(self.path)
-        self.manifest = Manifest(self.path)
+        with trace.phase('manifest parsing', path=self.path):
+            self.manifest = Manifest(self.path)
 
         self.use_id_in_path = use_id_in_path
         self.in_virtualenv = 'VIRTUAL_ENV' in os.environ
@@ -73,8 +75,7 @@ class Context(object):
             dirname
         )
 
-        if not os.path.exists(user_path):
-            os.makedirs(user_path)
+        ensure_directory(user_path)
 
         return user_path
 
@@ -100,6 +101,10 @@ class Component(object):
 
     __manifest__ = 'manifest.xml'
 
+    # Run the `prepare` calls of features in parallel threads, see
+    # `cream.features.load_features_concurrently`.
+    concurrent_features = False
+
     def __init__(self, path=None, user_path_prefix='', use_id_in_path=False):
 
         if path:
@@ -121,18 +126,72 @@ class Component(object):
         # Load required features...
         self._features = list()
         self._loaded_features = set()
+        self._lazy_features = dict()
+        self._prepared_features = dict()
 
+        features = list()
         for feature_name, kwargs in self.context.manifest['features']:
             try:
                 feature_class = FEATURES[feature_name]
             except KeyError:
                 raise NoSuchFeature("Could not load feature '%s'" % feature_name)
+
+            kwargs = dict(kwargs)
+            lazy = kwargs.pop('lazy', 'false') == 'true'
+            if lazy and feature_class.provides:
+                self.defer_feature(feature_class, **kwargs)
             else:
+                features.append((feature_class, kwargs))
+
+        if self.concurrent_features and len(features) > 1:
+            load_features_concurrently(self, features)
+        else:
+            for feature_class, kwargs in features:
                 self.load_feature(feature_class, **kwargs)
 
+        if self._lazy_features:
+            from gi.repository import GLib as glib
+            glib.idle_add(self._load_lazy_feature_cb)
+
 
     def load_feature(self, feature_class, **kwargs):
         """ Make sure a feature is only loaded once for a Component. """
         if feature_class not in self._loaded_features:
-            self._features.append(feature_class(self, **kwargs))
+            # A deferred feature loaded as a dependency keeps its own arguments.
+            deferred_kwargs = self._discard_lazy_feature(feature_class)
+            if deferred_kwargs is not None:
+                kwargs = deferred_kwargs
+            with trace.phase('feature', feature=feature_class.__name__):
+                self._features.append(feature_class(self, **kwargs))
             self._loaded_features.add(feature_class)
+
+    def defer_feature(self, feature_class, **kwargs):
+        """
+        Load a feature on first access to one of the attributes it
+        provides, or once the mainloop is idle, whatever comes first.
+        """
+        for attribute in feature_class.provides:
+            self._lazy_features[attribute] = (feature_class, kwargs)
+
+    def _discard_lazy_feature(self, feature_class):
+        """ Returns the arguments `feature_class` was deferred with, if any. """
+        deferred_kwargs = None
+        for attribute, (lazy_class, kwargs) in self._lazy_features.items():
+            if lazy_class is feature_class:
+                del self._lazy_features[attribute]
+                deferred_kwargs = kwargs
+        return deferred_kwargs
+
+    def _load_lazy_feature_cb(self):
+        if self._lazy_features:
+            feature_class, kwargs = self._lazy_features.values()[0]
+            self.load_feature(feature_class, **kwargs)
+        return bool(self._lazy_features)
+
+    def __getattr__(self, name):
+        lazy_features = self.__dict__.get('_lazy_features')
+        if lazy_features and name in lazy_features:
+            feature_class, kwargs = lazy_features[name]
+            self.load_feature(feature_class, **kwargs)
+            return getattr(self, name)
+        raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
@@ -17,12 +17,14 @@
 
 # TODO: Rewrite this.
 
-from gi.repository import Gtk as gtk
+import copy
+from UserDict import DictMixin
+from contextlib import contextmanager
 
 from gpyconf import Configuration as _Configuration
 from gpyconf.fields import Field
 
-from .backend import CreamXMLBackend
+from .backend import CreamXMLBackend, BackgroundWriter
 from cream.util import flatten, cached_property
 
 PROFILE_EXISTS_MARKUP = '''<span weight="bold" size="large"> \
@@ -41,21 +43,98 @@ class ProfileNotEditable(Exception):
     pass
 
 
+def get_backend(name):
+    """ Returns the configuration backend class called `name` (`xml` or `sqlite`). """
+    if name == 'xml':
+        return CreamXMLBackend
+    elif name == 'sqlite':
+        from .sqlite import CreamSQLiteBackend
+        return CreamSQLiteBackend
+    raise ValueError("Unknown configuration backend '%s'" % name)
+
+
+class ProfileValues(DictMixin):
+    """
+    Values of a profile, layered over the values of the default profile
+    (`defaults`). Only values differing from the defaults are stored in
+    `overrides`; setting a value back to its default removes the override.
+    """
+
+    def __init__(self, defaults, overrides=()):
+        self.defaults = defaults
+        self.overrides = {}
+        self.update(overrides)
+
+    def __getitem__(self, key):
+        try:
+            return self.overrides[key]
+        except KeyError:
+            return self.defaults[key]
+
+    def __setitem__(self, key, value):
+        if key in self.defaults and self.defaults[key] == value:
+            self.overrides.pop(key, None)
+        else:
+            self.overrides[key] = value
+
+    def __delitem__(self, key):
+        """ Reset `key` to its default value. """
+        del self.overrides[key]
+
+    def __contains__(self, key):
+        return key in self.overrides or key in self.defaults
+
+    def __iter__(self):
+        for key in self.defaults:
+            yield key
+        for key in self.overrides:
+            if key not in self.defaults:
+                yield key
+
+    def __len__(self):
+        return len(self.defaults) + sum(1 for key in self.overrides
+                                        if key not in self.defaults)
+
+    def __eq__(self, other):
+        return dict(self.iteritems()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def keys(self):
+        return list(self)
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    def __repr__(self):
+        return '<ProfileValues %r>' % self.overrides
+
+
 class ConfigurationProfile(object):
     """ A configuration profile. Holds name and assigned values. """
     is_editable = True
+    loaded = True
+    # Called with the profile and the names of the changed values (`None`
+    # for all of them) after they were changed using `set`, `update` or by
+    # assigning `values`:
+    changed_cb = None
 
-    def __init__(self, name, values, editable=True):
+    def __init__(self, name, values, editable=True, defaults=None):
         self.name = name
+        if defaults is not None:
+            values = ProfileValues(defaults, values)
         self.default_values = values
         self.is_editable = editable
         self._values = values
 
     @classmethod
     def fromdict(cls, dct, default_profile):
-        values = default_profile.values.copy()
-        values.update(dct.get('values', ()))
-        return cls(dct.pop('name'), values, dct.pop('editable', True))
+        if 'load' in dct:
+            return LazyConfigurationProfile(dct.pop('name'), dct.pop('load'),
+                                            default_profile, dct.pop('editable', True))
+        return cls(dct.pop('name'), dct.get('values', ()), dct.pop('editable', True),
+                   defaults=default_profile.values)
 
     @property
     def values(self):
@@ -67,22 +146,64 @@ class ConfigurationProfile(object):
         if not self.is_editable:
             raise ProfileNotEditable(self)
         else:
+            if isinstance(self._values, ProfileValues) and \
+                    not isinstance(value, ProfileValues):
+                value = ProfileValues(self._values.defaults, value)
             self._values = value
+            self._changed()
+
+    @property
+    def overrides(self):
+        """ The values to save: those differing from the default profile's. """
+        values = self.values
+        if isinstance(values, ProfileValues):
+            return values.overrides
+        return values
 
     def update(self, iterable):
         if not self.is_editable:
             raise ProfileNotEditable(self)
-        self.values.update(iterable)
+        values = dict(iterable)
+        self.values.update(values)
+        self._changed(values.keys())
 
     def set(self, name, value):
         if not self.is_editable:
             raise ProfileNotEditable(self)
         self.values[name] = value
+        self._changed((name,))
+
+    def _changed(self, names=None):
+        if self.changed_cb is not None:
+            self.changed_cb(self, names)
 
     def __repr__(self):
         return "<Profile '%s'%s>" % (self.name,
             not self.is_editable and ' (not editable)' or '')
 
+class LazyConfigurationProfile(ConfigurationProfile):
+    """ A profile whose values are only loaded (using `load`) when needed. """
+
+    def __init__(self, name, load, default_profile, editable=True):
+        ConfigurationProfile.__init__(self, name, None, editable)
+        self._load = load
+        self._default_profile = default_profile
+
+    @property
+    def loaded(self):
+        return self._values is not None
+
+    @property
+    def values(self):
+        if self._values is None:
+            values = ProfileValues(self._default_profile.values, self._load())
+            self.default_values = self._values = values
+        return self._values
+
+    @values.setter
+    def values(self, value):
+        ConfigurationProfile.values.fset(self, value)
+
 class DefaultProfile(ConfigurationProfile):
     """ Default configuration profile (using in-code defined values) """
     def __init__(self, values):
@@ -99,11 +220,14 @@ class ProfileList(list):
     default = None
     active = None
     active_index = 0
+    # Called like `ConfigurationProfile.changed_cb` for all profiles in the list:
+    changed_cb = None
 
     def __init__(self, default_profile):
         list.__init__(self)
         list.append(self, default_profile)
         self.default = default_profile
+        default_profile.changed_cb = self._profile_changed_cb
 
     def insert(self, index, profile, overwrite=False):
         assert index
@@ -118,8 +242,13 @@ class ProfileList(list):
             else:
                 old_profile.values = profile.values
         else:
+            profile.changed_cb = self._profile_changed_cb
             list.insert(self, index, profile)
 
+    def _profile_changed_cb(self, profile, names):
+        if self.changed_cb is not None:
+            self.changed_cb(profile, names)
+
     def append(self, *args, **kwargs):
         self.insert(len(self), *args, **kwargs)
     add = append
@@ -152,23 +281,40 @@ class Configuration(_Configuration):
     """
     Base class for all cream configurations.
     """
+    __events__ = _Configuration.__events__ + ('values-changed',)
     backend = CreamXMLBackend
     profiles = ()
 
+    # Milliseconds `request_save` waits for further changes before saving:
+    save_delay = 500
+    # Whether to load the values of profiles only when they are used:
+    lazy_profiles = False
+    _save_source = None
+    _writer = None
+    # Values before the outermost `batch` and names of the fields changed since:
+    _batch_values = None
+    _batch_changed = None
+
     @cached_property
     def frontend(self):
         from .frontend import CreamFrontend
         return CreamFrontend
 
 
-    def __init__(self, scheme_path, path, **kwargs):
+    def __init__(self, scheme_path, path, backend=None, lazy_profiles=None, **kwargs):
         # Make sure this instance's `fields` dict is *not* the classes'
         # `fields` dict (hence, the `fields` attribute of class `cls`),
         # but a copy of it.
         # TODO: There has to be a better way.
         self.fields = self.fields.copy()
+        if lazy_profiles is not None:
+            self.lazy_profiles = lazy_profiles
 
-        backend = CreamXMLBackend(scheme_path, path)
+        if backend is None:
+            backend = self.backend
+        elif isinstance(backend, basestring):
+            backend = get_backend(backend)
+        backend = backend(scheme_path, path)
 
         try:
             configuration_scheme = backend.read_scheme()
@@ -177,6 +323,10 @@ class Configuration(_Configuration):
         except MissingConfigurationDefinitionFile:
             pass
 
+        # The defaults of the scheme, which all profiles are layered over.
+        # Captured before reading, the fields hold profile values afterwards.
+        self._scheme_defaults = copy.deepcopy(self.fields.name_value_dict)
+
         _Configuration.__init__(self, backend_instance=backend, **kwargs)
 
 
@@ -185,15 +335,56 @@ class Configuration(_Configuration):
         self.fields[name] = field
         field.connect('value-changed', self.on_field_value_changed)
 
+    def on_field_value_changed(self, sender, field, new_value):
+        self.__dict__.pop(field.field_var, None)
+        if self._batch_changed is not None:
+            self._batch_changed.add(field.field_var)
+        else:
+            _Configuration.on_field_value_changed(self, sender, field, new_value)
+
+    @property
+    def batching(self):
+        """ Whether changes are currently collected by `batch`. """
+        return self._batch_changed is not None
+
+    @contextmanager
+    def batch(self):
+        """
+        Collect the field changes made within this context and emit a
+        single `values-changed` event with a `{name: (old_value, new_value)}`
+        dict of them at the end, instead of one `field-value-changed` each.
+        Fields still emit their own `value-changed` signals.
+        """
+        if self._batch_changed is not None:
+            yield
+            return
+
+        self._batch_values = dict((name, field.value) for name, field in self.fields.iteritems())
+        self._batch_changed = set()
+        try:
+            yield
+        finally:
+            old_values, changed = self._batch_values, self._batch_changed
+            self._batch_values = self._batch_changed = None
+
+            diff = {}
+            for name in changed:
+                new_value = self.fields[name].value
+                if old_values.get(name) != new_value:
+                    diff[name] = (old_values.get(name), new_value)
+            if diff:
+                self.emit('values-changed', diff)
+
     def read(self):
         if not self.initially_read:
             predefined_profiles = self.profiles
         else:
             predefined_profiles = ()
 
-        self.profiles = ProfileList(DefaultProfile(self.fields.name_value_dict)) # TODO: remove static options
+        self.profiles = ProfileList(DefaultProfile(copy.deepcopy(self._scheme_defaults))) # TODO: remove static options
+        self.profiles.changed_cb = self._profile_changed_cb
 
-        static_options, profiles = self.backend_instance.read()
+        static_options, profiles = self.backend_instance.read(lazy=self.lazy_profiles)
 
         for field_name, value in static_options.iteritems():
             setattr(self, field_name, value)
@@ -213,23 +404,43 @@ class Configuration(_Configuration):
         new_value = super(Configuration, self).__setattr__(attr, value)
         if new_value is not None and not self.fields[attr].static:
             self.profiles.active.set(attr, new_value)
+        if attr in self.fields:
+            self.__dict__.pop(attr, None)
 
     def __getattr__(self, name):
         field = self.fields.get(name)
         if field is not None:
             if field.static:
-                return field.value
+                value = field.value
             else:
-                return self.profiles.active.values[name]
+                value = self.profiles.active.values[name]
+            # Cache the value in the instance dict, so following reads are
+            # plain attribute lookups which don't reach `__getattr__`. Dropped
+            # again whenever the field is set or the profile is switched.
+            self.__dict__[name] = value
+            return value
         else:
             raise AttributeError("No such attribute '%s'" % name)
 
+    def _uncache_values(self, names=None):
+        """ Drop the values of `names` (or all fields) cached by `__getattr__`. """
+        for name in (self.fields if names is None else names):
+            self.__dict__.pop(name, None)
+
+    def _profile_changed_cb(self, profile, names):
+        if profile is self.profiles.active:
+            self._uncache_values(names)
+
     def use_profile(self, profile):
         self.profiles._use(profile)
-        for name, instance in self.fields.iteritems():
-            if instance.static: continue
-            instance.value = self.profiles.active.values[name]
-            self.profiles.active.values[name] = instance.value
+        self._uncache_values()
+        with self.batch():
+            for name, instance in self.fields.iteritems():
+                if instance.static: continue
+                instance.value = self.profiles.active.values[name]
+                self.profiles.active.values[name] = instance.value
+            # Listeners may have read values before they were normalized above.
+            self._uncache_values()
 
 
     # FRONTEND:
@@ -256,14 +467,16 @@ class Configuration(_Configuration):
         self.use_profile(index)
         self._ignore_frontend = False
         self.window.editable = self.profiles.active.is_editable
-        self.save()
+        self.request_save()
 
     def frontend_add_profile(self, sender, profile_name, position):
         """ User added a profile using the "add profile" button """
-        profile = ConfigurationProfile(profile_name, self.fields.name_value_dict)
+        profile = ConfigurationProfile(profile_name, self.fields.name_value_dict,
+                                       defaults=self.profiles.default.values)
         try:
             self.profiles.insert(position, profile)
         except ProfileExistsError:
+            from gi.repository import Gtk as gtk
             dialog = gtk.MessageDialog(
                 parent=None,
                 flags=gtk.DIALOG_MODAL,
@@ -276,13 +489,13 @@ class Configuration(_Configuration):
         else:
             self.window.insert_profile(profile, position)
             self.window.set_active_profile_index(position)
-            self.save()
+            self.request_save()
 
     def frontend_remove_profile(self, sender, position):
         """ User removed a profile using the "remove profile" button """
         del self.profiles[position]
         self.window.remove_profile(position)
-        self.save()
+        self.request_save()
 
 
     def run_frontend(self):
@@ -295,8 +508,45 @@ class Configuration(_Configuration):
 
     # BACKEND
     def save(self):
+        """ Save synchronously, after any background writes requested before. """
+
+        if self._save_source is not None:
+            from gi.repository import GLib as glib
+            glib.source_remove(self._save_source)
+            self._save_source = None
+
         self.emit('pre-save')
-        self.backend_instance.save(self.profiles, self.fields)
+        changes = self.backend_instance.get_changes(self.profiles, self.fields)
+        if self._writer is not None:
+            self._writer.join()
+        self.backend_instance.write_changes(changes)
+
+    def request_save(self):
+        """
+        Save `save_delay` milliseconds from now, writing the files on a
+        background thread. Further requests until then are coalesced.
+        """
+        if self._save_source is None:
+            from gi.repository import GLib as glib
+            self._save_source = glib.timeout_add(self.save_delay, self._save_timeout_cb)
+
+    def _save_timeout_cb(self):
+
+        self._save_source = None
+        self.emit('pre-save')
+        changes = self.backend_instance.get_changes(self.profiles, self.fields)
+        if changes[0] or changes[1]:
+            if self._writer is None:
+                self._writer = BackgroundWriter(self.backend_instance)
+            self._writer.put(changes)
+        return False
+
+    def flush(self):
+        """ Carry out a pending `request_save` and wait until everything is written. """
+        if self._save_source is not None:
+            self.save()
+        elif self._writer is not None:
+            self._writer.join()
 
 
 
@@ -16,17 +16,24 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
+import copy
+import marshal
+import hashlib
+import threading
+from Queue import Queue
 
 from lxml.etree import XMLSyntaxError, parse as parse_xml
 from cream.util.string import slugify
-from cream.util.xmlserialize import unserialize_file, unserialize_atomic, serialize_to_file
+from cream.util import atomic_write
+from cream.util.xmlserialize import unserialize_file, unserialize_atomic, serialize
 
 from gpyconf.backends import Backend
 import gpyconf.fields
-import gpyconf.contrib.gtk
 import cream.config.fields
 
 from cream.util.dicts import ordereddict
+from cream.path import CREAM_CACHE_HOME, ensure_directory
+from cream.manifest import stat_stamp
 
 FIELD_TYPE_MAP = {
     'char' : 'str',
@@ -46,21 +53,116 @@ CONFIGURATION_SCHEME_FILE = 'scheme.xml'
 PROFILE_ROOT_NODE         = 'configuration_profile'
 STATIC_OPTIONS_ROOT_NODE  = 'static_options'
 PROFILE_DIR               = 'profiles'
+PROFILE_INDEX_FILE        = 'profiles.index'
+PROFILE_INDEX_VERSION     = 2
+
+# Set `CREAM_SCHEME_CACHE=1` to persist compiled schemes across processes:
+SCHEME_CACHE_DIR          = os.path.join(CREAM_CACHE_HOME, 'schemes')
+SCHEME_CACHE_VERSION      = 1
+PERSISTENT_SCHEME_CACHE   = os.environ.get('CREAM_SCHEME_CACHE') == '1'
+
+# Maps scheme paths to `(stamp, spec)` tuples, see `compile_scheme`:
+_compiled_schemes = {}
+_field_classes = {}
+
+IMMUTABLE_TYPES = (basestring, int, long, float, bool, type(None))
 
 
 def get_field(name):
-    if not name.endswith('Field'):
-        name = name.title() + 'Field'
+    if name in _field_classes:
+        return _field_classes[name]
 
+    field_name = name
+    if not field_name.endswith('Field'):
+        field_name = field_name.title() + 'Field'
+
+    field_class = _find_field(field_name)
+    _field_classes[name] = field_class
+    return field_class
+
+def _find_field(name):
     try: return getattr(cream.config.fields, name)
     except AttributeError: pass
     try: return getattr(gpyconf.fields, name)
     except AttributeError: pass
-    try: return getattr(gpyconf.contrib.gtk, name)
+    # Only the GTK specific fields (e.g. hotkeys) need GTK.
+    from gpyconf.contrib import gtk as gtk_fields
+    try: return getattr(gtk_fields, name)
     except AttributeError:
         raise FieldNotFound(name)
 
 
+def compile_scheme(path):
+    """
+    Parse the configuration scheme at `path` into a list of
+    `(option_name, option_type, attributes)` tuples, `attributes` being the
+    keyword arguments for the option's field class.
+    """
+
+    tree = parse_xml(path)
+    root = tree.getroot()
+    spec = []
+
+    for child in root.getchildren():
+        option_name = child.tag
+        attributes = dict(child.attrib)
+        option_type = attributes.pop('type')
+        if option_type.startswith('multioption'):
+            # TODO: Hrm
+            attributes['default'] = child.attrib.pop('default', None)
+            attributes['options'] = unserialize_atomic(child, FIELD_TYPE_MAP)
+        else:
+            if not (
+                FIELD_TYPE_MAP.get(option_type) in ('list', 'tuple', 'dict')
+                and not child.getchildren()
+            ):
+                attributes['default'] = unserialize_atomic(child, FIELD_TYPE_MAP)
+        spec.append((option_name, option_type, attributes))
+
+    return spec
+
+def _get_scheme_cache_path(path):
+    return os.path.join(SCHEME_CACHE_DIR, hashlib.sha1(path).hexdigest() + '.cache')
+
+def get_compiled_scheme(path):
+    """
+    Returns the compiled scheme at `path` (see `compile_scheme`), cached in
+    memory and, if `PERSISTENT_SCHEME_CACHE` is set, on disk as long as the
+    file doesn't change.
+    """
+
+    path = os.path.abspath(path)
+    stamp = stat_stamp(path)
+
+    cached = _compiled_schemes.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    spec = None
+    if PERSISTENT_SCHEME_CACHE:
+        try:
+            with open(_get_scheme_cache_path(path), 'rb') as f:
+                version, cached_stamp, cached_spec = marshal.load(f)
+            if version == SCHEME_CACHE_VERSION and tuple(cached_stamp) == stamp:
+                spec = cached_spec
+        except (IOError, EOFError, ValueError, TypeError):
+            pass
+
+    if spec is None:
+        spec = compile_scheme(path)
+        if PERSISTENT_SCHEME_CACHE:
+            try:
+                ensure_directory(SCHEME_CACHE_DIR)
+                atomic_write(_get_scheme_cache_path(path),
+                             marshal.dumps((SCHEME_CACHE_VERSION, stamp, spec)))
+            except (IOError, OSError, ValueError):
+                # Not writable, or defaults marshal can't handle.
+                pass
+
+    _compiled_schemes[path] = (stamp, spec)
+    return spec
+
+
 class FieldNotFound(Exception):
     pass
 
@@ -74,7 +176,14 @@ class CreamXMLBackend(dict, Backend):
         self.path = path
 
         self.profile_dir = os.path.join(self.path, PROFILE_DIR)
+        self.index_path = os.path.join(self.path, PROFILE_INDEX_FILE)
+        # Whether to maintain the profile index, see `read`:
+        self.use_index = False
 
+        # Contents of the files as last read or written, so `save` only
+        # writes what changed:
+        self._profile_snapshots = {}
+        self._static_options_snapshot = None
 
     def read_scheme(self):
 
@@ -82,30 +191,26 @@ class CreamXMLBackend(dict, Backend):
             from . import MissingConfigurationDefinitionFile
             raise MissingConfigurationDefinitionFile("Could not find %r." % self.scheme_path)
 
-        tree = parse_xml(self.scheme_path)
-        root = tree.getroot()
         scheme = ordereddict()
-
-        for child in root.getchildren():
-            option_name = child.tag
-            attributes = dict(child.attrib)
-            option_type = attributes.pop('type')
-            if option_type.startswith('multioption'):
-                # TODO: Hrm
-                attributes['default'] = child.attrib.pop('default', None)
-                attributes['options'] = unserialize_atomic(child, FIELD_TYPE_MAP)
-            else:
-                if not (
-                    FIELD_TYPE_MAP.get(option_type) in ('list', 'tuple', 'dict')
-                    and not child.getchildren()
-                ):
-                    attributes['default'] = unserialize_atomic(child, FIELD_TYPE_MAP)
+        for option_name, option_type, attributes in get_compiled_scheme(self.scheme_path):
+            # Fields may hold on to (and modify) their arguments.
+            attributes = dict((key, value if isinstance(value, IMMUTABLE_TYPES)
+                                         else copy.deepcopy(value))
+                              for key, value in attributes.iteritems())
             scheme[option_name] = get_field(option_type)(**attributes)
 
         return scheme
 
 
-    def read(self):
+    def read(self, lazy=False):
+        """
+        Returns a `(static_options, profiles)` tuple, `profiles` being a list
+        of dicts with the keys `name`, `position`, `selected` and `values`.
+
+        If `lazy` is set, profiles are read from an index of their names,
+        positions and selection state instead, and have a `load` callable
+        returning their values in place of `values`.
+        """
 
         static_options = {}
         profiles = []
@@ -113,60 +218,212 @@ class CreamXMLBackend(dict, Backend):
         try:
             obj = unserialize_file(os.path.join(self.path, 'static-options.xml'))
             static_options.update(obj)
+            self._static_options_snapshot = copy.deepcopy(static_options)
         except:
             pass
 
         if not os.path.exists(self.profile_dir):
             return dict(), tuple()
 
+        if lazy:
+            self.use_index = True
+            index = self.read_index()
+            if index is not None:
+                # Sorted, so inserting them one by one restores their positions.
+                for name, basename, position, selected in sorted(index, key=lambda entry: entry[2]):
+                    filename = os.path.join(self.profile_dir, basename)
+                    profile = {'name': name, 'position': position, 'selected': selected}
+                    self._profile_snapshots[filename] = profile.copy()
+                    profile['load'] = lambda filename=filename: self.load_profile(filename)
+                    profiles.append(profile)
+                return static_options, profiles
+
         for profile in os.listdir(self.profile_dir):
-            if os.path.isdir(os.path.join(self.profile_dir, profile)):
+            filename = os.path.join(self.profile_dir, profile)
+            if os.path.isdir(filename):
                 continue
             try:
-                obj = unserialize_file(os.path.join(self.profile_dir, profile))
+                obj = unserialize_file(filename)
             except XMLSyntaxError,  err:
                 self.warn("Could not parse XML configuration file '{file}': {error}".format(
                     file=profile, error=err))
             else:
+                self._profile_snapshots[filename] = copy.deepcopy(obj)
                 profiles.append(obj)
 
+        if lazy:
+            self.write_index()
+
         return static_options, profiles
 
 
-    def save(self, profile_list, fields):
+    def load_profile(self, filename):
+        """ Returns the values of the profile stored in `filename`. """
 
-        if not os.path.exists(self.profile_dir):
-            os.makedirs(self.profile_dir)
+        try:
+            obj = unserialize_file(filename)
+        except (IOError, XMLSyntaxError), err:
+            self.warn("Could not read configuration file '{file}': {error}".format(
+                file=filename, error=err))
+            return {}
 
-        # get all saved profiles
-        saved_profiles = {}
-        for profile in os.listdir(self.profile_dir):
-            name = os.path.splitext(profile)[0]
-            saved_profiles[name] = os.path.join(self.profile_dir, profile)
+        self._profile_snapshots[filename] = copy.deepcopy(obj)
+        return obj['values']
+
+
+    def read_index(self):
+        """
+        Returns the profile index as a list of `(name, basename, position,
+        selected)` tuples, or `None` if it's missing or outdated. The file
+        names are relative to `profile_dir`, so the index stays usable if
+        the configuration is moved.
+        """
 
+        try:
+            with open(self.index_path, 'rb') as f:
+                version, stamp, index = marshal.load(f)
+            if version != PROFILE_INDEX_VERSION or stamp != os.stat(self.profile_dir).st_mtime:
+                return None
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        return index
+
+    def write_index(self):
+
+        index = [(profile['name'], os.path.basename(filename),
+                  profile['position'], profile['selected'])
+                 for filename, profile in self._profile_snapshots.items()]
+        try:
+            stamp = os.stat(self.profile_dir).st_mtime
+            atomic_write(self.index_path,
+                         marshal.dumps((PROFILE_INDEX_VERSION, stamp, index)))
+        except (IOError, OSError, ValueError):
+            # The index is an optimization only.
+            pass
+
+
+    def get_changes(self, profile_list, fields):
+        """
+        Returns a `(writes, removals)` tuple: `writes` maps the names of
+        files whose content changed since they were last read or saved to
+        `(object, tag)` tuples to serialize, `removals` lists the files of
+        deleted profiles. From now on, these changes count as saved.
+        """
+
+        writes = {}
+        removals = []
+
+        if self._profile_snapshots and not os.path.exists(self.profile_dir):
+            # Removed while we were running, write everything again.
+            self._profile_snapshots = {}
+            self._static_options_snapshot = None
+
+        profiles = {}
         for index, profile in enumerate(profile_list):
             if not profile.is_editable: continue
 
-            filename = os.path.join(os.path.join(self.path, PROFILE_DIR), slugify(profile.name)+'.xml')
+            filename = os.path.join(self.profile_dir, slugify(profile.name)+'.xml')
+            selected = profile_list.active == profile
+
+            if not profile.loaded:
+                snapshot = self._profile_snapshots.get(filename)
+                if (snapshot is not None and snapshot['position'] == index
+                        and snapshot['selected'] == selected):
+                    # Unchanged, as its values weren't even looked at.
+                    profiles[filename] = snapshot
+                    continue
 
-            serialize_to_file({
+            profiles[filename] = {
                 'name' : profile.name,
-                'values' : profile.values,
+                'values' : profile.overrides,
                 'position' : index,
-                'selected' : profile_list.active == profile
-            }, filename, tag=PROFILE_ROOT_NODE)
+                'selected' : selected
+            }
 
-            if profile.name.lower() in saved_profiles:
-                del saved_profiles[profile.name.lower()]
+        for filename, profile in profiles.iteritems():
+            if self._profile_snapshots.get(filename) != profile:
+                self._profile_snapshots[filename] = copy.deepcopy(profile)
+                writes[filename] = (self._profile_snapshots[filename], PROFILE_ROOT_NODE)
 
-        # `saved_profiles` now contains profiles, which have been removed
-        # but are still present in the filesystem. Remove them.
-        for profile in saved_profiles.values():
-            os.remove(profile)
+        # Profiles which have been removed but are still present in the
+        # filesystem.
+        for filename in set(self._profile_snapshots).difference(profiles):
+            del self._profile_snapshots[filename]
+            removals.append(filename)
 
         static_options = dict((name, field.value) for name, field in
                               fields.iteritems() if field.static)
-        if static_options:
-            serialize_to_file(static_options,
-                os.path.join(self.path, STATIC_OPTIONS_FILE),
-                tag=STATIC_OPTIONS_ROOT_NODE)
+        if static_options and static_options != self._static_options_snapshot:
+            self._static_options_snapshot = copy.deepcopy(static_options)
+            writes[os.path.join(self.path, STATIC_OPTIONS_FILE)] = (
+                self._static_options_snapshot, STATIC_OPTIONS_ROOT_NODE)
+
+        return writes, removals
+
+
+    def write_changes(self, changes):
+        """ Write changes returned by `get_changes`. Files are replaced atomically. """
+
+        writes, removals = changes
+
+        # Not `ensure_directory`, the directory may be removed at any time.
+        if writes and not os.path.exists(self.profile_dir):
+            os.makedirs(self.profile_dir)
+
+        for filename, (obj, tag) in writes.iteritems():
+            try:
+                atomic_write(filename, serialize(obj, tag=tag))
+            except:
+                # Make the next save try again.
+                self._profile_snapshots.pop(filename, None)
+                if tag == STATIC_OPTIONS_ROOT_NODE:
+                    self._static_options_snapshot = None
+                raise
+
+        for filename in removals:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+        if self.use_index and (removals or any(
+                os.path.dirname(filename) == self.profile_dir for filename in writes)):
+            self.write_index()
+
+
+    def save(self, profile_list, fields):
+        """
+        Write the editable profiles and static options which changed since
+        they were last read or saved, and remove files of deleted profiles.
+        """
+        self.write_changes(self.get_changes(profile_list, fields))
+
+
+class BackgroundWriter(object):
+    """ Writes changes of a `CreamXMLBackend` in order, on a worker thread. """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.queue = Queue()
+        self.thread = None
+
+    def put(self, changes):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='BackgroundWriter')
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put(changes)
+
+    def run(self):
+        while True:
+            changes = self.queue.get()
+            try:
+                self.backend.write_changes(changes)
+            except Exception, err:
+                self.backend.warn("Could not save configuration: %s" % err)
+            finally:
+                self.queue.task_done()
+
+    def join(self):
+        """ Block until all changes put so far are written. """
+        self.queue.join()
@@ -16,17 +16,18 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 from gpyconf.fields import FontField as _FontField, MultiOptionField
-from gpyconf.frontends.gtk import font_description_to_dict, dict_to_font_description
 
 
 MultioptionField = MultiOptionField
 
 class FontDict(dict):
     def to_string(self):
+        from gpyconf.frontends.gtk import dict_to_font_description
         return dict_to_font_description(self)
 
     @classmethod
     def fromstring(cls, string):
+        from gpyconf.frontends.gtk import font_description_to_dict
         d = font_description_to_dict(string)
         d['color'] = '#000000'
         return cls(d)
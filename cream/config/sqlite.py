@@ -0,0 +1,258 @@
+# Copyright: 2007-2013, Sebastian Billaudelle <sbillaudelle@googlemail.com>
+#            2010-2013, Kristoffer Kleine <kris.kleine@yahoo.de>
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+    SQLite configuration backend
+    ----------------------------
+
+    Keeps the static options and all profiles of a configuration in a
+    single SQLite database, one row per option. Only options which changed
+    are written, all in one transaction. Values are stored in the same
+    XML serialization the XML backend uses, so both read back the same
+    types.
+
+    On first use, an existing XML configuration is imported. The XML files
+    are left in place.
+"""
+
+import os
+import copy
+import sqlite3
+import threading
+
+from lxml.etree import fromstring as xml_fromstring
+
+from cream.util.xmlserialize import serialize, unserialize_atomic
+
+from .backend import CreamXMLBackend
+
+DATABASE_FILE = 'configuration.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS static_options (
+    field TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    selected INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profile_values (
+    profile TEXT NOT NULL REFERENCES profiles (name) ON DELETE CASCADE,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (profile, field)
+);
+'''
+
+def encode_value(value):
+    return serialize(value, 'value').decode('utf-8')
+
+def decode_value(text):
+    return unserialize_atomic(xml_fromstring(text.encode('utf-8')))
+
+
+class CreamSQLiteBackend(CreamXMLBackend):
+
+    def __init__(self, scheme_path, path):
+        CreamXMLBackend.__init__(self, scheme_path, path)
+
+        self.database_path = os.path.join(self.path, DATABASE_FILE)
+        self._connection = None
+        # Writes may happen on a `BackgroundWriter` thread.
+        self._lock = threading.Lock()
+
+        # Values as last read or written, see `get_changes`:
+        self._static_snapshot = {}
+        self._profile_snapshots = {}
+        self._meta_snapshots = {}
+
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            # Not `ensure_directory`, the directory may be removed at any time.
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            self._connection = sqlite3.connect(self.database_path,
+                                               check_same_thread=False)
+            self._connection.execute('PRAGMA foreign_keys = ON')
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+
+    def migrate(self):
+        """ Import the XML configuration, unless that was done before. """
+
+        connection = self.connection
+        if connection.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            return
+
+        static_options, profiles = CreamXMLBackend.read(self)
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO static_options VALUES (?, ?)',
+                [(name, encode_value(value)) for name, value in static_options.iteritems()])
+            for profile in profiles:
+                connection.execute('INSERT OR IGNORE INTO profiles VALUES (?, ?, ?)',
+                    (profile['name'], profile['position'], profile.get('selected', False)))
+                connection.executemany('INSERT OR REPLACE INTO profile_values VALUES (?, ?, ?)',
+                    [(profile['name'], name, encode_value(value))
+                     for name, value in profile['values'].iteritems()])
+            connection.execute("INSERT INTO meta VALUES ('migrated', '1')")
+
+
+    def read(self, lazy=False):
+
+        with self._lock:
+            self.migrate()
+            connection = self.connection
+
+            static_options = dict((name, decode_value(value)) for name, value in
+                connection.execute('SELECT field, value FROM static_options'))
+
+            profiles = {}
+            for name, position, selected in connection.execute(
+                    'SELECT name, position, selected FROM profiles ORDER BY position'):
+                profiles[name] = {
+                    'name' : name,
+                    'position' : position,
+                    'selected' : bool(selected),
+                    'values' : {}
+                }
+            if lazy:
+                for name, profile in profiles.iteritems():
+                    del profile['values']
+                    profile['load'] = lambda name=name: self.load_profile(name)
+            else:
+                for profile, name, value in connection.execute(
+                        'SELECT profile, field, value FROM profile_values'):
+                    profiles[profile]['values'][name] = decode_value(value)
+
+        self._static_snapshot = copy.deepcopy(static_options)
+        self._profile_snapshots = dict((name, copy.deepcopy(profile.get('values', {})))
+                                       for name, profile in profiles.iteritems())
+        self._meta_snapshots = dict((name, (profile['position'], profile['selected']))
+                                    for name, profile in profiles.iteritems())
+
+        return static_options, sorted(profiles.values(), key=lambda p: p['position'])
+
+
+    def load_profile(self, name):
+        """ Returns the values of the profile called `name`. """
+
+        with self._lock:
+            values = dict((field, decode_value(value)) for field, value in self.connection.execute(
+                'SELECT field, value FROM profile_values WHERE profile = ?', (name,)))
+        self._profile_snapshots[name] = copy.deepcopy(values)
+        return values
+
+
+    def get_changes(self, profile_list, fields):
+        """
+        Returns a `(writes, removals)` tuple of the rows which changed since
+        they were last read or saved, see `CreamXMLBackend.get_changes`.
+        """
+
+        writes = {'profiles': [], 'values': [], 'static': []}
+        removals = {'profiles': [], 'values': []}
+
+        with self._lock:
+            if self._connection is not None and not os.path.exists(self.database_path):
+                # Removed while we were running: start a new database (which
+                # must not import the XML configuration) and write everything.
+                self._connection.close()
+                self._connection = None
+                with self.connection as connection:
+                    connection.execute("INSERT OR IGNORE INTO meta VALUES ('migrated', '1')")
+                self._static_snapshot = {}
+                self._profile_snapshots = {}
+                self._meta_snapshots = {}
+
+        names = set()
+        for index, profile in enumerate(profile_list):
+            if not profile.is_editable: continue
+            names.add(profile.name)
+
+            meta = (index, profile_list.active == profile)
+            if self._meta_snapshots.get(profile.name) != meta:
+                self._meta_snapshots[profile.name] = meta
+                writes['profiles'].append((profile.name,) + meta)
+
+            snapshot = self._profile_snapshots.setdefault(profile.name, {})
+            if not profile.loaded:
+                continue
+            overrides = profile.overrides
+            for name, value in overrides.iteritems():
+                if name not in snapshot or snapshot[name] != value:
+                    snapshot[name] = copy.deepcopy(value)
+                    writes['values'].append((profile.name, name, snapshot[name]))
+            for name in set(snapshot).difference(overrides):
+                del snapshot[name]
+                removals['values'].append((profile.name, name))
+
+        for name in set(self._profile_snapshots).difference(names):
+            del self._profile_snapshots[name]
+            self._meta_snapshots.pop(name, None)
+            removals['profiles'].append(name)
+
+        for name, field in fields.iteritems():
+            if not field.static: continue
+            if name not in self._static_snapshot or self._static_snapshot[name] != field.value:
+                self._static_snapshot[name] = copy.deepcopy(field.value)
+                writes['static'].append((name, self._static_snapshot[name]))
+
+        return (dict((key, rows) for key, rows in writes.iteritems() if rows),
+                dict((key, rows) for key, rows in removals.iteritems() if rows))
+
+
+    def write_changes(self, changes):
+        """ Write changes returned by `get_changes` in a single transaction. """
+
+        writes, removals = changes
+        if not writes and not removals:
+            return
+
+        with self._lock:
+            try:
+                with self.connection as connection:
+                    connection.executemany('DELETE FROM profiles WHERE name = ?',
+                        [(name,) for name in removals.get('profiles', ())])
+                    connection.executemany('DELETE FROM profile_values WHERE profile = ? AND field = ?',
+                        removals.get('values', ()))
+                    # Not `INSERT OR REPLACE`, which would delete the profile's values.
+                    connection.executemany('UPDATE profiles SET position = ?, selected = ? WHERE name = ?',
+                        [(position, selected, name) for name, position, selected
+                         in writes.get('profiles', ())])
+                    connection.executemany('INSERT OR IGNORE INTO profiles VALUES (?, ?, ?)',
+                        writes.get('profiles', ()))
+                    connection.executemany('INSERT OR REPLACE INTO profile_values VALUES (?, ?, ?)',
+                        [(profile, name, encode_value(value))
+                         for profile, name, value in writes.get('values', ())])
+                    connection.executemany('INSERT OR REPLACE INTO static_options VALUES (?, ?)',
+                        [(name, encode_value(value))
+                         for name, value in writes.get('static', ())])
+            except:
+                # The transaction was rolled back, make the next save write everything.
+                self._static_snapshot = {}
+                self._profile_snapshots = {}
+                self._meta_snapshots = {}
+                raise
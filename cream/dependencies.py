@@ -0,0 +1,309 @@
+# Copyright: 2007-2013, Sebastian Billaudelle <sbillaudelle@googlemail.com>
+#            2010-2013, Kristoffer Kleine <kris.kleine@yahoo.de>
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from collections import defaultdict
+
+
+class CyclicDependency(Exception):
+    def __init__(self, cycle):
+        Exception.__init__(self, "Cyclic dependency: %s" % ' -> '.join(cycle))
+        self.cycle = cycle
+
+
+class DependencyResolver(object):
+    """
+    Resolves the dependencies declared in the manifests of a `ManifestDB`.
+
+    A dependency with an id refers to the component with that id; one
+    with a type only is satisfied by every component of that type or
+    providing it. Dependencies are required unless `required` is
+    ``'false'``.
+
+    The dependency graph is built on first use. Transitive dependencies
+    and load order levels are cached per component and only invalidated
+    for the components affected by a change. If `db` is a
+    `cream.monitor.LiveManifestDB`, changes are picked up automatically,
+    otherwise call `invalidate` for changed components.
+    """
+
+    def __init__(self, db):
+
+        self.db = db
+
+        self.edges = None                       # { id: set of dependency ids }
+        self.dependents = defaultdict(set)      # { id: set of dependent ids }
+        self.unresolved = {}                    # { id: [dependency, ...] }
+        self.provided = {}                      # { id: set of types it is or provides }
+        self.type_dependents = defaultdict(set) # { type: set of ids depending on it by type }
+        self._dependency_types = {}             # { id: set of types it depends on }
+
+        self._closures = {}
+        self._levels = {}
+
+        if hasattr(db, 'connect'):
+            for signal in ('manifest-added', 'manifest-changed', 'manifest-removed'):
+                db.connect(signal, self.manifest_changed_cb)
+
+
+    def _build(self):
+
+        if self.edges is not None:
+            return
+
+        self.edges = {}
+        for manifest in self.db.get_all():
+            self._resolve(manifest)
+
+    @staticmethod
+    def _types(manifest):
+        types = set(manifest['provided-components'])
+        types.add(manifest['type'])
+        return types
+
+    def _providers(self, type):
+        ids = set(m['id'] for m in self.db.find(type=type))
+        ids.update(m['id'] for m in self.db.find(provides=type))
+        return ids
+
+    def _resolve(self, manifest):
+        """ (Re-)build the outgoing edges of `manifest`. """
+
+        id = manifest['id']
+        self._unlink(id)
+
+        edges = set()
+        unresolved = []
+        dependency_types = set()
+        for dependency in manifest['dependencies']:
+            if dependency['id']:
+                if dependency['id'] in self.db.manifests:
+                    ids = set((dependency['id'],))
+                else:
+                    ids = set()
+            else:
+                ids = self._providers(dependency['type'])
+                ids.discard(id)
+                dependency_types.add(dependency['type'])
+
+            if ids:
+                edges.update(ids)
+            else:
+                unresolved.append(dependency)
+
+        self.edges[id] = edges
+        for dependency_id in edges:
+            self.dependents[dependency_id].add(id)
+        if unresolved:
+            self.unresolved[id] = unresolved
+        self.provided[id] = self._types(manifest)
+        self._dependency_types[id] = dependency_types
+        for type in dependency_types:
+            self.type_dependents[type].add(id)
+
+    def _unlink(self, id):
+        for dependency_id in self.edges.pop(id, ()):
+            self.dependents[dependency_id].discard(id)
+        for type in self._dependency_types.pop(id, ()):
+            self.type_dependents[type].discard(id)
+        self.unresolved.pop(id, None)
+        self.provided.pop(id, None)
+
+
+    def invalidate(self, id):
+        """
+        Update the graph after the manifest of component `id` has been
+        added, changed or removed.
+        """
+
+        if self.edges is None:
+            return
+
+        # Components which need their edges resolved again: `id` itself,
+        # its dependents (if `id` is gone or changed its type), all
+        # components depending on a type `id` was or is now (they may
+        # have gained or lost a provider) and all components with
+        # unresolved dependencies `id` might satisfy now.
+        types = set(self.provided.get(id, ()))
+        manifest = self.db.manifests.get(id)
+        if manifest is not None:
+            types.update(self._types(manifest))
+
+        stale = set((id,)) | self.dependents.get(id, set()) | set(self.unresolved)
+        for type in types:
+            stale.update(self.type_dependents.get(type, ()))
+
+        for stale_id in stale:
+            manifest = self.db.manifests.get(stale_id)
+            if manifest is not None:
+                self._resolve(manifest)
+            else:
+                self._unlink(stale_id)
+
+        # Drop cached results for all of them and everything depending on them.
+        affected = set(stale)
+        for stale_id in stale:
+            affected.update(self.get_dependents(stale_id))
+        for affected_id in affected:
+            self._closures.pop(affected_id, None)
+            self._levels.pop(affected_id, None)
+
+    def manifest_changed_cb(self, db, manifest):
+        self.invalidate(manifest['id'])
+
+
+    def get_dependencies(self, id):
+        """ Returns the set of ids `id` depends on, directly or indirectly. """
+
+        self._build()
+
+        closure = self._closures.get(id)
+        if closure is None:
+            closure = set()
+            stack = list(self.edges.get(id, ()))
+            while stack:
+                dependency_id = stack.pop()
+                if dependency_id not in closure:
+                    closure.add(dependency_id)
+                    stack.extend(self.edges.get(dependency_id, ()))
+            self._closures[id] = closure
+        return closure
+
+    def get_dependents(self, id):
+        """ Returns the set of ids depending on `id`, directly or indirectly. """
+
+        self._build()
+
+        result = set()
+        stack = list(self.dependents.get(id, ()))
+        while stack:
+            dependent_id = stack.pop()
+            if dependent_id not in result:
+                result.add(dependent_id)
+                stack.extend(self.dependents.get(dependent_id, ()))
+        return result
+
+    def get_missing(self):
+        """
+        Returns a dictionary mapping ids to the list of their required
+        dependencies which couldn't be resolved.
+        """
+
+        self._build()
+
+        missing = {}
+        for id, dependencies in self.unresolved.iteritems():
+            required = [d for d in dependencies if d['required'] != 'false']
+            if required:
+                missing[id] = required
+        return missing
+
+    def get_cycles(self):
+        """ Returns a list of all dependency cycles, each a list of ids. """
+
+        self._build()
+
+        # Tarjan's strongly connected components algorithm, iteratively.
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        cycles = []
+
+        for root in self.edges:
+            if root in index:
+                continue
+            work = [(root, iter(self.edges[root]))]
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in self.edges:
+                        continue
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self.edges[child])))
+                        break
+                    elif child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        if len(component) > 1 or node in self.edges[node]:
+                            cycles.append(component)
+
+        return cycles
+
+
+    def get_level(self, id, _path=()):
+        """
+        Returns the load order level of `id`: 0 if it has no dependencies,
+        otherwise one more than the highest level of its dependencies.
+        Raises `CyclicDependency` if `id` depends on itself.
+        """
+
+        self._build()
+
+        level = self._levels.get(id)
+        if level is None:
+            path = _path + (id,)
+            level = 0
+            for dependency_id in self.edges.get(id, ()):
+                if dependency_id in path:
+                    raise CyclicDependency(path[path.index(dependency_id):] + (dependency_id,))
+                level = max(level, self.get_level(dependency_id, path) + 1)
+            self._levels[id] = level
+        return level
+
+    def get_load_order(self, ids=None):
+        """
+        Returns a list of groups (sets of ids) in which the components
+        `ids` and their dependencies have to be loaded. All components in
+        a group only depend on components in earlier groups, so each
+        group may be loaded in parallel. If `ids` is `None`, all known
+        components are ordered.
+
+        Raises `CyclicDependency` if any of those components are part of
+        a dependency cycle.
+        """
+
+        self._build()
+
+        if ids is None:
+            ids = set(self.edges)
+        else:
+            ids = set(ids)
+            for id in list(ids):
+                ids.update(self.get_dependencies(id))
+
+        groups = defaultdict(set)
+        for id in ids:
+            groups[self.get_level(id)].add(id)
+        return [groups[level] for level in sorted(groups)]
@@ -20,7 +20,7 @@ import sys
 import inspect
 import imp
 
-from . import Component
+from .base import Component
 from .manifest import ManifestDB
 
 EXTENSIONS = {}
@@ -48,14 +48,15 @@ class ExtensionManager(object):
         self.paths = paths
         self.interface = interface
 
-        self.extensions = ManifestDB(self.paths, type='org.cream.Extension')
+        # Lazy, so manifests of other types are only parsed up to their type.
+        self.extensions = ManifestDB(self.paths, type='org.cream.Extension', lazy=True)
 
     def load_all(self, interface=None, *args, **kwargs):
         return map(lambda ext: self._load(ext, interface),
                    self.extensions.by_name.itervalues())
 
     def load_by_name(self, name, interface=None, *args, **kwargs):
-        ext = self.extensions.get(name=name).next()
+        ext = self.extensions.get(name=name)
         return self._load(ext, interface)
 
 
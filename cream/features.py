@@ -16,17 +16,26 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
-from gi.repository import GObject as gobject
+import sys
 import weakref
 
+from cream.util import trace
+
 FEATURES = dict()
 
+# Maximum number of threads used by `load_features_concurrently`
+# and `finalize_features_concurrently`:
+MAX_FEATURE_THREADS = 4
+
 class NoSuchFeature(Exception):
     pass
 
 class Feature(object):
     """ "Feature" that can be "mixed" into Cream components. """
     dependencies = None
+    # Attributes this feature sets on its component. Features providing
+    # any can be loaded lazily using `<use-feature ... lazy="true"/>`.
+    provides = ()
 
     def __new__(cls, component, *args, **kwargs):
         """ Make sure all dependencies for this feature are loaded. """
@@ -35,14 +44,32 @@ class Feature(object):
                 component.load_feature(dependency, *args, **kwargs)
         return super(Feature, cls).__new__(cls)
 
+    @classmethod
+    def prepare(cls, component, **kwargs):
+        """
+        Do work not depending on other features (e.g. blocking D-Bus
+        calls) ahead of `__init__`, which gets the result from
+        `get_prepared`. When features are loaded concurrently, this runs
+        in parallel to the initialization of the feature's dependencies.
+        """
+        return None
+
+    def get_prepared(self, component, **kwargs):
+        """ Returns the result of `prepare`, calling it if necessary. """
+        result = component._prepared_features.pop(type(self), None)
+        if result is None:
+            return self.prepare(component, **kwargs)
+        return result.get()
+
     def __finalize__(self):
         pass
 
 
 class ConfigurationFeature(Feature):
+    provides = ('config',)
     autosave = True
 
-    def __init__(self, component, read=True):
+    def __init__(self, component, read=True, backend='xml', lazy_profiles=False):
 
         self.component_ref = weakref.ref(component)
 
@@ -51,6 +78,8 @@ class ConfigurationFeature(Feature):
         else:
             read = False
 
+        lazy_profiles = lazy_profiles in (True, 'true')
+
         Feature.__init__(self)
 
         from .config import Configuration
@@ -60,6 +89,8 @@ class ConfigurationFeature(Feature):
 
         component.config = Configuration(scheme_path,
                                          config_dir,
+                                         backend=backend,
+                                         lazy_profiles=lazy_profiles,
                                          read=read)
         self.config = component.config
 
@@ -70,54 +101,111 @@ class ConfigurationFeature(Feature):
         if self.autosave:
             component.messages.debug("Automatically saving configuration...")
             self.config.save()
+        else:
+            self.config.flush()
+
+
+_hotkey_signals_class = None
+
+def _get_hotkey_signals_class():
+    """ Defines the GObject emitting `HotkeyFeature`'s signals on first use. """
+
+    global _hotkey_signals_class
+
+    if _hotkey_signals_class is None:
+        from gi.repository import GObject as gobject
+
+        class HotkeySignals(gobject.GObject):
+            __gtype_name__ = 'HotkeyFeature'
+            __gsignals__ = {
+                'hotkey-activated': (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_STRING,)),
+            }
 
+        _hotkey_signals_class = HotkeySignals
+    return _hotkey_signals_class
 
-class HotkeyFeature(Feature, gobject.GObject):
+
+class HotkeyFeature(Feature):
     dependencies = (ConfigurationFeature,)
+    provides = ('hotkeys',)
+
+    @classmethod
+    def prepare(cls, component):
 
-    __gtype_name__ = 'HotkeyFeature'
-    __gsignals__ = {
-        'hotkey-activated': (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_STRING,)),
-    }
+        import cream.ipc
+        from dbus.exceptions import DBusException
+
+        try:
+            manager = cream.ipc.get_object('org.cream.HotkeyManager', '/org/cream/HotkeyManager')
+        except DBusException:
+            return None
+
+        broker = cream.ipc.get_object('org.cream.HotkeyManager', manager.register(), interface='org.cream.HotkeyManager.broker')
+        return manager, broker
 
     def __init__(self, component):
 
         from gpyconf.contrib.gtk import HotkeyField
-        import cream.ipc
-        from dbus.exceptions import DBusException
 
         Feature.__init__(self)
-        gobject.GObject.__init__(self)
+        self._signals = _get_hotkey_signals_class()()
 
         self.component = weakref.ref(component)
         self.component().hotkeys = self
 
-        try:
-            self.manager = cream.ipc.get_object('org.cream.HotkeyManager', '/org/cream/HotkeyManager')
-        except DBusException:
+        prepared = self.get_prepared(component)
+        if prepared is None:
             import warnings
             warnings.warn("Could not connect to the cream hotkey manager")
             return
 
-        self.broker = cream.ipc.get_object('org.cream.HotkeyManager', self.manager.register(), interface='org.cream.HotkeyManager.broker')
+        self.manager, self.broker = prepared
         self.broker.connect_to_signal('hotkey_activated', self.hotkey_activated_cb)
 
-        for name, field in self.component().config.fields.iteritems():
+        config = self.component().config
+        for name, field in config.fields.iteritems():
             if isinstance(field, HotkeyField):
                 self.broker.set_hotkey(field.action, field.value)
                 field.connect('value-changed', self.configuration_field_value_changed_cb)
+        config.connect('values-changed', self.configuration_values_changed_cb)
 
 
     def configuration_field_value_changed_cb(self, source, field, value):
 
+        if self.component().config.batching:
+            # Handled by `configuration_values_changed_cb` once the batch is done.
+            return
         self.broker.set_hotkey(field.action, field.value)
 
+    def configuration_values_changed_cb(self, config, diff):
+
+        from gpyconf.contrib.gtk import HotkeyField
+
+        for name in diff:
+            field = config.fields[name]
+            if isinstance(field, HotkeyField):
+                self.broker.set_hotkey(field.action, field.value)
+
+
+    def connect(self, signal, callback, *args):
+        """ Connect to a signal, see `GObject.connect`. """
+        return self._signals.connect(signal,
+            lambda signals, *values: callback(self, *values), *args)
+
+    def disconnect(self, handler_id):
+        self._signals.disconnect(handler_id)
+
+    def emit(self, signal, *args):
+        self._signals.emit(signal, *args)
+
 
     def hotkey_activated_cb(self, action):
         self.emit('hotkey-activated', action)
 
 
 class ExtensionFeature(Feature):
+    provides = ('extension_manager',)
+
     def __init__(self, component, directory='extensions'):
         Feature.__init__(self, component)
 
@@ -129,6 +217,128 @@ class ExtensionFeature(Feature):
         )
 
 
+def load_features_concurrently(component, features):
+    """
+    Load `features`, a list of `(feature_class, kwargs)` tuples, for
+    `component`, running their `Feature.prepare` calls on a thread pool.
+
+    Dependencies not listed are added just like `Feature.__new__` would
+    add them. `prepare` is started for all features right away, while the
+    features are initialized one after another in dependency order by
+    the calling (mainloop) thread, so registering with the component and
+    connecting GObject and D-Bus signal handlers never happens on a worker
+    thread. A feature's `__init__` only waits for its own `prepare`.
+    """
+
+    from multiprocessing.pool import ThreadPool
+
+    order = []
+    arguments = {}
+
+    def add(feature_class, kwargs):
+        if feature_class in arguments or feature_class in component._loaded_features:
+            return
+        deferred_kwargs = component._discard_lazy_feature(feature_class)
+        if deferred_kwargs is not None:
+            kwargs = deferred_kwargs
+        for dependency in feature_class.dependencies or ():
+            add(dependency, kwargs)
+        order.append(feature_class)
+        arguments[feature_class] = kwargs
+
+    for feature_class, kwargs in features:
+        add(feature_class, kwargs)
+
+    preparing = [feature_class for feature_class in order
+                 if feature_class.prepare.__func__ is not Feature.prepare.__func__]
+
+    pool = None
+    if preparing:
+        from gi.repository import GObject as gobject
+        gobject.threads_init()
+        pool = ThreadPool(min(len(preparing), MAX_FEATURE_THREADS))
+        for feature_class in preparing:
+            component._prepared_features[feature_class] = pool.apply_async(
+                feature_class.prepare, (component,), arguments[feature_class])
+
+    try:
+        # `order` lists dependencies before their dependents.
+        for feature_class in order:
+            with trace.phase('feature', feature=feature_class.__name__):
+                feature = feature_class(component, **arguments[feature_class])
+            component._features.append(feature)
+            component._loaded_features.add(feature_class)
+    finally:
+        if pool is not None:
+            pool.close()
+
+
+def finalize_features_concurrently(features, timeout=None):
+    """
+    Call `__finalize__` of all `features` on a thread pool. Features are
+    finalized in waves, dependents before their dependencies, the features
+    of a wave concurrently. Waiting stops once `timeout` seconds passed.
+
+    Returns a list of `(feature, duration, exc_info)` tuples, `duration`
+    being `None` for features not finalized in time.
+    """
+
+    from multiprocessing import TimeoutError
+    from multiprocessing.pool import ThreadPool
+
+    if not features:
+        return []
+
+    loaded = set(type(feature) for feature in features)
+    levels = {}
+
+    def get_level(feature_class):
+        if feature_class not in levels:
+            levels[feature_class] = 1 + max([get_level(dependency)
+                for dependency in feature_class.dependencies or ()
+                if dependency in loaded] or [-1])
+        return levels[feature_class]
+
+    waves = {}
+    for feature in features:
+        waves.setdefault(get_level(type(feature)), []).append(feature)
+
+    def finalize(feature):
+        start = trace.monotonic()
+        try:
+            feature.__finalize__()
+            error = None
+        except Exception:
+            error = sys.exc_info()
+        return trace.monotonic() - start, error
+
+    deadline = None if timeout is None else trace.monotonic() + timeout
+    pool = ThreadPool(min(len(features), MAX_FEATURE_THREADS))
+    report = []
+    try:
+        for level in sorted(waves, reverse=True):
+            if deadline is not None and trace.monotonic() >= deadline:
+                report.extend((feature, None, None) for feature in waves[level])
+                continue
+
+            results = [(feature, pool.apply_async(finalize, (feature,)))
+                       for feature in waves[level]]
+            for feature, result in results:
+                try:
+                    if deadline is None:
+                        duration, error = result.get()
+                    else:
+                        duration, error = result.get(max(0, deadline - trace.monotonic()))
+                except TimeoutError:
+                    duration, error = None, None
+                report.append((feature, duration, error))
+    finally:
+        # Don't wait for finalizers which didn't finish in time.
+        pool.close()
+
+    return report
+
+
 FEATURES.update({
     'org.cream.extensions'  : ExtensionFeature,
     'org.cream.config'      : ConfigurationFeature,
@@ -20,9 +20,15 @@ from xml.dom import minidom
 import ctypes
 from ctypes import *
 
-_lib = CDLL('librsvg-2.so')
-gobject = CDLL('libgobject-2.0.so')
-gobject.g_type_init()
+_lib = None
+
+def get_library():
+    """ Loads librsvg on first use. """
+    global _lib
+    if _lib is None:
+        _lib = CDLL('librsvg-2.so')
+        CDLL('libgobject-2.0.so').g_type_init()
+    return _lib
 
 class RsvgDimensionData(Structure):
     _fields_ = [("width", c_int),
@@ -39,12 +45,16 @@ class PycairoContext(Structure):
                 ("ctx", c_void_p),
                 ("base", c_void_p)]
 
-handle_get_dimensions = _lib.rsvg_handle_get_dimensions
-handle_render_cairo = _lib.rsvg_handle_render_cairo
-handle_render_cairo_sub = _lib.rsvg_handle_render_cairo_sub
-handle_free = _lib.rsvg_handle_free
-handle_get_dimensions_sub = _lib.rsvg_handle_get_dimensions_sub
-handle_get_position_sub = _lib.rsvg_handle_get_position_sub
+def _lib_function(name):
+    return lambda *args: getattr(get_library(), name)(*args)
+
+handle_get_dimensions = _lib_function('rsvg_handle_get_dimensions')
+handle_render_cairo = _lib_function('rsvg_handle_render_cairo')
+handle_render_cairo_sub = _lib_function('rsvg_handle_render_cairo_sub')
+handle_free = _lib_function('rsvg_handle_free')
+handle_get_dimensions_sub = _lib_function('rsvg_handle_get_dimensions_sub')
+handle_get_position_sub = _lib_function('rsvg_handle_get_position_sub')
+handle_new_from_data = _lib_function('rsvg_handle_new_from_data')
 
 __all__ = [
     'handle_new_from_file', 
@@ -76,7 +86,7 @@ class Handle:
             set_id_attribute(self.dom)
             self.dom.save = self.save_dom
             xml = self.dom.toxml('utf-8')
-            self.handle = _lib.rsvg_handle_new_from_data(xml, len(xml))
+            self.handle = handle_new_from_data(xml, len(xml))
 
 
     def save_dom(self):
@@ -84,7 +94,7 @@ class Handle:
         handle_free(self.handle)
 
         xml = self.dom.toxml('utf-8')
-        self.handle = _lib.rsvg_handle_new_from_data(xml, len(xml))
+        self.handle = handle_new_from_data(xml, len(xml))
 
 
     @classmethod
@@ -95,7 +105,7 @@ class Handle:
         set_id_attribute(self.dom)
         self.dom.save = self.save_dom
         xml = self.dom.toxml('utf-8')
-        self.handle = _lib.rsvg_handle_new_from_data(xml, len(xml))
+        self.handle = handle_new_from_data(xml, len(xml))
         return self
 
 
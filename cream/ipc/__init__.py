@@ -15,6 +15,8 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
+import json
+import threading
 from types import FunctionType
 
 import gi
@@ -23,13 +25,16 @@ from gi.repository import GObject as gobject
 import dbus
 import dbus.proxies
 import dbus.service
-from dbus.lowlevel import SignalMessage
-
 import dbus.mainloop.glib
-dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+from dbus.lowlevel import SignalMessage
 
 from . import hacks, properties
 from .tools import bus_name_to_path, path_to_bus_name
+from cream.util import trace
+
+# Opens no connection, so it's done right away: buses created by others
+# (e.g. passed as `Object(bus=...)`) need a mainloop too.
+dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
 
 class IpcProxyInterface(dbus.Interface):
     def get_extension(self, name, interface=None):
@@ -37,11 +42,51 @@ class IpcProxyInterface(dbus.Interface):
                 '/'.join((self.object_path, name)),
                 interface)
 
-SESSION_BUS = dbus.SessionBus()
-SYSTEM_BUS = dbus.SystemBus()
+class LazyBus(object):
+    """
+    A D-Bus connection which is only established on first use and
+    re-established if it was lost. Attributes are looked up on the
+    actual connection, use `connect` where a real one is needed.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._bus = None
+        self._lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self._bus is not None and self._bus.get_is_connected()
+
+    def connect(self):
+        """ Returns the connection, connecting if necessary. """
+        with self._lock:
+            if not self.connected:
+                if self._bus is not None:
+                    # Drops the stale connection from dbus-python's shared instances.
+                    self._bus.close()
+                self._bus = self._factory()
+            return self._bus
+
+    def __getattr__(self, attr):
+        return getattr(self.connect(), attr)
+
+def get_bus(bus):
+    """ Returns the real connection for `bus`, which may be a `LazyBus`. """
+    if isinstance(bus, LazyBus):
+        return bus.connect()
+    return bus
+
+SESSION_BUS = LazyBus(dbus.SessionBus)
+SYSTEM_BUS = LazyBus(dbus.SystemBus)
 
 PATH_SEP = '/'
 
+TRACE_INTERFACE = 'org.cream.StartupTrace'
+
+# `dbus.service.BusName`s acquired by `Object`s:
+_bus_names = []
+
 _INTERFACE_SENTINEL = 'THIS.IS.AN.INTERFACE.NAME.USED.AS.A.SENTINEL.AND.I.LIKE.TURTLES'
 
 def get_object(modname, path=None, interface=None, bus=SESSION_BUS):
@@ -50,14 +95,50 @@ def get_object(modname, path=None, interface=None, bus=SESSION_BUS):
     if interface is None:
         interface = path_to_bus_name(path)
     return IpcProxyInterface(
-            bus.get_object(modname, path),
+            get_bus(bus).get_object(modname, path),
             interface
             )
 
+def release_bus_names():
+    """ Release all bus names acquired by `Object`s in this process. """
+
+    while _bus_names:
+        name = _bus_names.pop()
+        try:
+            name.get_bus().release_name(name.get_name())
+        except dbus.exceptions.DBusException:
+            pass
+
 class IpcError(Exception):
     pass
 
 
+def method(doodle='', out_signature='', interface=None):
+
+    # two choices:
+    # 1) called as @ipc.method
+    if isinstance(doodle, FunctionType):
+        doodle._ipc_name = doodle.__name__
+        doodle._ipc_in_signature = ''
+        doodle._ipc_out_signature = ''
+        doodle._ipc_expose = True
+        doodle._ipc_interface = interface
+        return doodle
+
+    # 2) called as @ipc.method()
+    else:
+        in_signature = doodle
+        def decorator(f):
+            f._ipc_name = f.__name__
+            f._ipc_in_signature = in_signature
+            f._ipc_out_signature = out_signature
+            f._ipc_expose = True
+            f._ipc_interface = interface
+            return f
+
+        return decorator
+
+
 if gi.version_info[0] == 3 and gi.version_info[1] >= 8:
     GObjectMeta = gobject.GObject.__class__
 else:
@@ -168,7 +249,10 @@ class Object(dbus.service.Object, gobject.GObject):
 
     def __init__(self, bus_name, path, interface=None, bus=SESSION_BUS):
 
-        self._dbus_bus_name = dbus.service.BusName(bus_name, bus)
+        bus = get_bus(bus)
+        with trace.phase('bus name acquisition', bus_name=bus_name):
+            self._dbus_bus_name = dbus.service.BusName(bus_name, bus)
+        _bus_names.append(self._dbus_bus_name)
 
         dbus.service.Object.__init__(self, self._dbus_bus_name, path)
         gobject.GObject.__init__(self)
@@ -181,6 +265,11 @@ class Object(dbus.service.Object, gobject.GObject):
         # set the new interface
         self.__class__._set_interface(self._interface)
 
+    @method('', 's', interface=TRACE_INTERFACE)
+    def get_startup_report(self):
+        """ Returns the startup trace of this process as JSON. """
+        return json.dumps(trace.get_report())
+
 """
 class Module(Object):
     def __init__(self, bus_name):
@@ -202,29 +291,3 @@ class Extension(Object):
                 path)
         self._parent = parent
 """
-
-def method(doodle='', out_signature='', interface=None):
-
-    # two choices:
-    # 1) called as @ipc.method
-    if isinstance(doodle, FunctionType):
-        doodle._ipc_name = doodle.__name__
-        doodle._ipc_in_signature = ''
-        doodle._ipc_out_signature = ''
-        doodle._ipc_expose = True
-        doodle._ipc_interface = interface
-        return doodle
-
-    # 2) called as @ipc.method()
-    else:
-        in_signature = doodle
-        def decorator(f):
-            f._ipc_name = f.__name__
-            f._ipc_in_signature = in_signature
-            f._ipc_out_signature = out_signature
-            f._ipc_expose = True
-            f._ipc_interface = interface
-            return f
-
-        return decorator
-
@@ -16,13 +16,28 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
+import sys
+import marshal
+import hashlib
 import itertools
-from lxml.etree import parse as parse_xml_file
+from collections import defaultdict
+from lxml.etree import parse as parse_xml_file, iterparse
 
 import cream.util
+from cream.path import CREAM_CACHE_HOME
 
 
 MANIFEST_FILE = 'manifest.xml'
+MANIFEST_COMPILED_FILE = MANIFEST_FILE + 'c'
+MANIFEST_COMPILED_VERSION = 2
+MANIFEST_CACHE_FILE = os.path.join(CREAM_CACHE_HOME, 'manifests.cache')
+MANIFEST_CACHE_VERSION = 2
+
+# Directories never searched for manifests:
+MANIFEST_IGNORE = ('.*', '__pycache__', 'data')
+
+# Maximum number of threads used to walk the paths of a `ManifestDB`:
+MAX_SCAN_THREADS = 4
 
 class ManifestException(BaseException):
     pass
@@ -30,165 +45,200 @@ class ManifestException(BaseException):
 class NoNamespaceDefinedException(BaseException):
     pass
 
-class Manifest(dict):
+class ManifestParser(object):
+    """
+    Parses a manifest document in a single, ordered pass.
+
+    Children of the component node are dispatched to handlers looked up
+    from `component_handlers` and the package node is handled by
+    `handle_package`, while a stack of the currently active namespaces is
+    kept up to date during the walk.
+    """
 
     def __init__(self, path, expand_paths=True):
 
-        dict.__init__(self)
+        self.path = path
+        self.expand_paths = expand_paths
+        self.namespaces = []
+
+
+    def expand_ns(self, s):
+        if s is not None and s.startswith('.'):
+            if self.namespaces:
+                return self.namespaces[-1] + s
+            else:
+                raise NoNamespaceDefinedException
+        else:
+            return s
 
-        self._path = path
-        self._tree = parse_xml_file(self._path)
+    def expand_path(self, p):
+        if self.expand_paths:
+            if p:
+                return os.path.join(os.path.dirname(self.path), p)
+        else:
+            return p
 
-        self['path'] = os.path.dirname(os.path.abspath(path))
 
-        root = self._tree.getroot()
+    def parse(self, root):
+
         if root.tag != 'manifest':
             raise ManifestException("Manifest root tag has to 'manifest'")
 
-        namespaces = []
+        manifest = {
+            'path': os.path.dirname(os.path.abspath(self.path)),
+            'licenses': [],
+            'categories': [],
+            'descriptions': {},
+            'authors': [],
+            'features': [],
+            'dependencies': [],
+            'provided-components': []
+        }
+
+        namespace = root.get('namespace')
+        if namespace:
+            self.namespaces.append(namespace)
 
-        def append_ns(e):
-            if e.get('namespace'):
-                namespaces.append(e.get('namespace'))
+        component_seen = False
+        for child in root:
+            if child.tag == 'component':
+                if not component_seen:
+                    component_seen = True
+                    self.walk(child, manifest, self.handle_component)
+            elif child.tag == 'package':
+                if 'package' not in manifest:
+                    self.walk(child, manifest, self.handle_package)
 
-        def remove_ns(e):
-            if e.get('namespace'):
-                namespaces.remove(e.get('namespace'))
+        if namespace:
+            self.namespaces.pop()
 
-        def expand_ns(s):
-            if s.startswith('.'):
-                if len(namespaces):
-                    return namespaces[-1] + s
-                else:
-                    raise NoNamespaceDefinedException
-            else:
-                return s
+        manifest['description'] = manifest['descriptions'].get('en') or ''
 
-        def expand_path(p):
-            if expand_paths:
-                if p:
-                    return os.path.join(os.path.dirname(self._path), p)
-            else:
-                return p
+        return manifest
+
+    def parse_header(self):
+        """
+        Parse only the attributes of the ``<component>`` node (see
+        `MANIFEST_HEADER_KEYS`), stopping as soon as it has been read.
+        """
+
+        manifest = {'path': os.path.dirname(os.path.abspath(self.path))}
 
-        # TODO: Use a bottom-down iteration here and lookup node handlers
-        # from a dict or so. Much faster!
+        events = iterparse(self.path, events=('start',))
+        event, root = next(events)
+        if root.tag != 'manifest':
+            raise ManifestException("Manifest root tag has to 'manifest'")
 
-        append_ns(root)
+        for event, element in events:
+            if element.tag == 'component' and element.getparent() is root:
+                break
+        else:
+            raise ManifestException("Manifest doesn't define a component")
 
-        component = root.find('component')
-        append_ns(component)
+        namespaces = [e.get('namespace') for e in (root, element) if e.get('namespace')]
+        self.namespaces.extend(namespaces)
+        self.parse_header_attributes(element, manifest)
+        del self.namespaces[len(self.namespaces) - len(namespaces):]
 
-        # General meta information:
-        self['id'] = expand_ns(component.get('id'))
-        self['type'] = expand_ns(component.get('type'))
-        self['name'] = component.get('name')
-        self['version'] = component.get('version')
-        self['exec'] = component.get('exec')
-
-        # Licenses:
-        self['licenses'] = []
-
-        licenses = component.findall('license')
-        for license in licenses:
-            append_ns(license)
-            self['licenses'].append({
-                'title'   : license.get('title'),
-                'version' : license.get('version')
-            })
-            remove_ns(license)
-
-        # Icon:
-        icon = component.find('icon')
-        if icon is not None:
-            append_ns(icon)
-            self['icon'] = expand_path(icon.get('path'))
-            remove_ns(icon)
-
-        # Category
-        self['categories'] = []
-
-        categories = component.findall('category')
-        for category in categories:
-            append_ns(category)
-            self['categories'].append({
-                'id'  : expand_ns(category.get('id'))
-            })
-            remove_ns(category)
-
-        # Descriptions:
-        self['descriptions'] = {}
-
-        descriptions = component.findall('description')
-        for descr in descriptions:
-            append_ns(descr)
-            self['descriptions'][descr.get('lang')] = descr.get('content')
-            remove_ns(descr)
-
-        self['description'] = self['descriptions'].get('en') or ''
-
-        # Authors:
-        self['authors'] = []
-
-        authors = component.findall('author')
-        for author in authors:
-            append_ns(author)
-            self['authors'].append({
-                'name': author.get('name'),
-                'type': author.get('type'),
-                'mail': author.get('mail')
-                })
-            remove_ns(author)
-
-        # Features:
-        self['features'] = []
-
-        features = component.findall('use-feature')
-        for feature in features:
-            append_ns(feature)
-            feature_args = {}
-
-            for k, v in feature.attrib.iteritems():
-                if not k in ['id']:
-                    feature_args[k] = v
-            self['features'].append(
-                (expand_ns(feature.attrib.pop('id')), feature_args)
-            )
-            remove_ns(feature)
-
-        # Dependencies:
-        self['dependencies'] = []
-
-        dependencies = component.findall('dependency')
-        for dependency in dependencies:
-            append_ns(dependency)
-            self['dependencies'].append({
-                'id'        : expand_ns(dependency.get('id')),
-                'type'      : expand_ns(dependency.get('type')),
-                'required'  : dependency.get('required')
-                })
-            remove_ns(dependency)
-
-        # Provided component types:
-        self['provided-components'] = []
-
-        provided_components = component.findall('provide-component')
-        for component in provided_components:
-            append_ns(component)
-            self['provided-components'].append(expand_ns(component.get('type')))
-            remove_ns(component)
-
-
-        # Package information:
-        package = root.find('package')
-        if package is None:
-            return
+        return manifest
 
-        self['package'] = {}
+    def walk(self, element, manifest, handler):
+        """
+        Call `handler` for `element` with its namespace pushed onto the
+        namespace stack.
+        """
 
-        self['package']['auto'] = package.get('auto') == 'true'
+        namespace = element.get('namespace')
+        if namespace:
+            self.namespaces.append(namespace)
+        handler(element, manifest)
+        if namespace:
+            self.namespaces.pop()
 
-        self['package']['rules'] = {
+
+    # Handlers:
+    def parse_header_attributes(self, component, manifest):
+
+        # General meta information:
+        manifest['id'] = self.expand_ns(component.get('id'))
+        manifest['type'] = self.expand_ns(component.get('type'))
+        manifest['name'] = component.get('name')
+        manifest['version'] = component.get('version')
+        manifest['exec'] = component.get('exec')
+
+    def handle_component(self, component, manifest):
+
+        self.parse_header_attributes(component, manifest)
+
+        handlers = self.component_handlers
+        for child in component:
+            handler = handlers.get(child.tag)
+            if handler is None:
+                continue
+            namespace = child.get('namespace')
+            if namespace:
+                self.namespaces.append(namespace)
+            handler(self, child, manifest)
+            if namespace:
+                self.namespaces.pop()
+
+    def handle_license(self, license, manifest):
+        manifest['licenses'].append({
+            'title'   : license.get('title'),
+            'version' : license.get('version')
+        })
+
+    def handle_icon(self, icon, manifest):
+        if 'icon' not in manifest:
+            manifest['icon'] = self.expand_path(icon.get('path'))
+
+    def handle_category(self, category, manifest):
+        manifest['categories'].append({
+            'id'  : self.expand_ns(category.get('id'))
+        })
+
+    def handle_description(self, descr, manifest):
+        manifest['descriptions'][descr.get('lang')] = descr.get('content')
+
+    def handle_author(self, author, manifest):
+        manifest['authors'].append({
+            'name': author.get('name'),
+            'type': author.get('type'),
+            'mail': author.get('mail')
+        })
+
+    def handle_feature(self, feature, manifest):
+        feature_args = dict(feature.attrib)
+        feature_id = feature_args.pop('id')
+        manifest['features'].append(
+            (self.expand_ns(feature_id), feature_args)
+        )
+
+    def handle_dependency(self, dependency, manifest):
+        manifest['dependencies'].append({
+            'id'        : self.expand_ns(dependency.get('id')),
+            'type'      : self.expand_ns(dependency.get('type')),
+            'required'  : dependency.get('required')
+        })
+
+    def handle_provided_component(self, component, manifest):
+        manifest['provided-components'].append(self.expand_ns(component.get('type')))
+
+    component_handlers = {
+        'license'           : handle_license,
+        'icon'              : handle_icon,
+        'category'          : handle_category,
+        'description'       : handle_description,
+        'author'            : handle_author,
+        'use-feature'       : handle_feature,
+        'dependency'        : handle_dependency,
+        'provide-component' : handle_provided_component
+    }
+
+
+    def handle_package(self, package, manifest):
+
+        rules = {
             'ignore': [],
             'application': [],
             'desktop': [],
@@ -196,20 +246,387 @@ class Manifest(dict):
             'library': [],
         }
 
-        rules = package.findall('rule')
-        for rule in rules:
-            type  = rule.get('type')
-            files = rule.get('files')
-            self['package']['rules'][type].append(files)
+        manifest['package'] = {
+            'auto': package.get('auto') == 'true',
+            'rules': rules
+        }
+
+        for rule in package:
+            if rule.tag == 'rule':
+                rules[rule.get('type')].append(rule.get('files'))
+
+
+# All keys a `Manifest` may have, mapped to the slots holding their values:
+MANIFEST_KEYS = ('path', 'id', 'type', 'name', 'version', 'exec', 'icon',
+                 'licenses', 'categories', 'descriptions', 'description',
+                 'authors', 'features', 'dependencies', 'provided-components',
+                 'package')
+MANIFEST_SLOTS = dict((key, '_' + key.replace('-', '_')) for key in MANIFEST_KEYS)
+# Keys available without loading the whole manifest:
+MANIFEST_HEADER_KEYS = ('path', 'id', 'type', 'name', 'version', 'exec')
+
+
+def _intern(s):
+    if type(s) is str:
+        return intern(s)
+    return s
+
+def _intern_values(dct, keys):
+    for key in keys:
+        dct[key] = _intern(dct[key])
+    return dct
+
+
+class Manifest(object):
+    """
+    Meta information on a component as read from its manifest file.
+
+    Values are kept in slots, with frequently repeated strings (types,
+    namespaced ids, license titles, ...) interned, and the XML tree is
+    released as soon as it has been parsed. The read-only part of the
+    `dict` interface is supported.
+
+    If `lazy` is set, only the `MANIFEST_HEADER_KEYS` are read initially.
+    The rest of the file is parsed on first access to any other key.
+    """
+
+    __slots__ = ('_file', '_expand_paths', '_loaded') + tuple(MANIFEST_SLOTS.values())
+
+    def __init__(self, path, expand_paths=True, lazy=False):
+
+        self._file = path
+        self._expand_paths = expand_paths
+        self._loaded = False
+
+        compiled = load_compiled(path, expand_paths)
+        if compiled is not None:
+            self._set_values(compiled)
+        elif lazy:
+            parser = ManifestParser(path, expand_paths)
+            self._set_values(parser.parse_header())
+        else:
+            self._load()
+
+    @classmethod
+    def fromdict(cls, path, data, expand_paths=True):
+        """
+        Create a `Manifest` for `path` from already parsed `data`, which
+        may contain the `MANIFEST_HEADER_KEYS` only.
+        """
+        manifest = cls.__new__(cls)
+        manifest._file = path
+        manifest._expand_paths = expand_paths
+        manifest._loaded = False
+        manifest._set_values(data)
+        return manifest
+
+    @property
+    def loaded(self):
+        """ `True` if all of the manifest has been parsed. """
+        return self._loaded
+
+    def _load(self):
+        tree = parse_xml_file(self._file)
+        parser = ManifestParser(self._file, self._expand_paths)
+        self._set_values(parser.parse(tree.getroot()))
+
+    def _set_values(self, data):
+
+        for key in ('id', 'type', 'version'):
+            data[key] = _intern(data[key])
+
+        for key, value in data.iteritems():
+            setattr(self, MANIFEST_SLOTS[key], value)
+
+        if 'licenses' not in data:
+            return
+
+        self._loaded = True
+
+        for license in data['licenses']:
+            _intern_values(license, ('title', 'version'))
+        for category in data['categories']:
+            _intern_values(category, ('id',))
+        for author in data['authors']:
+            _intern_values(author, ('type',))
+        for dependency in data['dependencies']:
+            _intern_values(dependency, ('id', 'type', 'required'))
+        self._features = [(_intern(id), args) for id, args in data['features']]
+        self._provided_components = map(_intern, data['provided-components'])
+
+    def todict(self):
+        """
+        Returns the values parsed so far as a `dict`. Unlike ``dict(self)``,
+        this doesn't load the rest of a lazily loaded manifest.
+        """
+        return dict((key, getattr(self, MANIFEST_SLOTS[key])) for key in MANIFEST_KEYS
+                    if hasattr(self, MANIFEST_SLOTS[key]))
+
+
+    def __getitem__(self, key):
+        try:
+            slot = MANIFEST_SLOTS[key]
+        except KeyError:
+            raise KeyError(key)
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            if not self._loaded:
+                self._load()
+                return self[key]
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if key not in MANIFEST_SLOTS:
+            return False
+        if not self._loaded and key not in MANIFEST_HEADER_KEYS:
+            self._load()
+        return hasattr(self, MANIFEST_SLOTS[key])
+    has_key = __contains__
+
+    def keys(self):
+        if not self._loaded:
+            self._load()
+        return [key for key in MANIFEST_KEYS if hasattr(self, MANIFEST_SLOTS[key])]
+
+    def iterkeys(self):
+        return iter(self.keys())
+    __iter__ = iterkeys
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def copy(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, Manifest):
+            other = dict(other.items())
+        elif not isinstance(other, dict):
+            return NotImplemented
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    # Unhashable, like the `dict` manifests used to be.
+    __hash__ = None
 
 
     def __str__(self):
-        return "<Manifest '{0}'>".format(self._path)
+        return "<Manifest '{0}'>".format(self._file)
+    __repr__ = __str__
+
+
+def get_compiled_path(path):
+    return os.path.join(os.path.dirname(path), MANIFEST_COMPILED_FILE)
+
+def get_compiled_stamp(path):
+    """
+    Returns the `(mtime, size)` of the manifest file at `path` a compiled
+    manifest is valid for. Unlike `stat_stamp`, it doesn't include the
+    inode, so compiled manifests stay valid when installed elsewhere.
+    """
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size)
+
+def compile_manifest(path):
+    """
+    Write a compiled version of the manifest file at `path` next to it.
+    `Manifest` prefers it over the XML file as long as the XML file's
+    modification time and size are the ones it was compiled from.
+    """
+
+    stamp = get_compiled_stamp(path)
+    tree = parse_xml_file(path)
+    data = ManifestParser(path, expand_paths=False).parse(tree.getroot())
+    # Paths are made absolute when loading, so the file may be relocated.
+    del data['path']
+
+    compiled_path = get_compiled_path(path)
+    tmp_path = '%s.%d' % (compiled_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        marshal.dump((MANIFEST_COMPILED_VERSION, stamp, data), f)
+    os.rename(tmp_path, compiled_path)
+
+def load_compiled(path, expand_paths=True):
+    """
+    Returns the data of the compiled version of the manifest file at
+    `path`, or `None` if there is none or it is outdated.
+    """
+
+    compiled_path = get_compiled_path(path)
+    try:
+        with open(compiled_path, 'rb') as f:
+            version, stamp, data = marshal.load(f)
+        if version != MANIFEST_COMPILED_VERSION or tuple(stamp) != get_compiled_stamp(path):
+            return None
+    except (OSError, IOError, EOFError, ValueError, TypeError):
+        return None
+
+    parser = ManifestParser(path, expand_paths)
+    data['path'] = os.path.dirname(os.path.abspath(path))
+    if 'icon' in data:
+        data['icon'] = parser.expand_path(data['icon'])
+    return data
+
+
+def stat_stamp(path):
+    """
+    Returns a `(mtime, size, inode)` tuple identifying the current
+    version of the file at `path`.
+    """
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+class ManifestCache(object):
+    """
+    Persistent index of parsed manifests, keyed by path. Every entry is
+    stored along with the `stat_stamp` of its file, so a scan only has to
+    parse manifests which changed since they were cached.
+    """
+
+    def __init__(self, path=MANIFEST_CACHE_FILE):
+
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+
+        self.load()
+
+    _instances = {}
+
+    @classmethod
+    def get_instance(cls, path=MANIFEST_CACHE_FILE):
+        """ Returns the cache for `path` shared by this process. """
+        if path not in cls._instances:
+            cls._instances[path] = cls(path)
+        return cls._instances[path]
+
+
+    def load(self):
+
+        try:
+            with open(self.path, 'rb') as f:
+                version, entries = marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return
+
+        if version == MANIFEST_CACHE_VERSION:
+            self.entries = entries
+
+    def save(self):
+
+        if not self.dirty:
+            return
+
+        tmp_path = '%s.%d' % (self.path, os.getpid())
+        try:
+            directory = os.path.dirname(self.path)
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(tmp_path, 'wb') as f:
+                marshal.dump((MANIFEST_CACHE_VERSION, self.entries), f)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            # The cache is an optimization only, so don't fail because
+            # of an unwritable cache directory.
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        else:
+            self.dirty = False
+
+
+    def get(self, path, stamp):
+        """
+        Returns a `(data, hash)` tuple of the cached data for `path` if it
+        matches `stamp`.
+        """
+        entry = self.entries.get(path)
+        if entry is not None and tuple(entry[0]) == stamp:
+            return entry[1], entry[2]
+
+    def set(self, path, stamp, data, hash):
+        self.entries[path] = (stamp, data, hash)
+        self.dirty = True
+
+    def prune(self, roots, seen):
+        """
+        Remove entries for `roots` or located below one of them which are
+        not in `seen` and whose files don't exist any more.
+
+        The cache is shared by all databases of the process, so entries
+        not seen by a walk with other `max_depth` or `ignore` settings
+        are kept.
+        """
+        prefixes = tuple(os.path.join(root, '') for root in roots)
+        for path in self.entries.keys():
+            if (path in roots or path.startswith(prefixes)) and path not in seen \
+                    and not os.path.exists(path):
+                del self.entries[path]
+                self.dirty = True
+
+
+def content_hash(path):
+    """ Returns the SHA-1 hex digest of the file at `path`. """
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# Functions returning the index keys of a manifest for every index
+# maintained by `ManifestDB`:
+MANIFEST_INDEXES = {
+    'name'      : lambda manifest, hash: (manifest['name'],),
+    'type'      : lambda manifest, hash: (manifest['type'],),
+    'provides'  : lambda manifest, hash: manifest['provided-components'],
+    'category'  : lambda manifest, hash: [c['id'] for c in manifest['categories']],
+    'hash'      : lambda manifest, hash: (hash,),
+}
+# Indexes requiring lazily loaded manifests to be loaded completely:
+MANIFEST_BODY_INDEXES = ('provides', 'category')
 
 
 class ManifestDB(object):
+    """
+    Database of all manifests found below `paths`.
+
+    Manifests are loaded lazily as they are needed. The database maintains
+    indexes on all keys in `MANIFEST_INDEXES` so queries using them don't
+    have to look at every manifest.
 
-    def __init__(self, paths, type=None):
+    If `lazy` is set, manifests are created with `Manifest`'s `lazy` option,
+    so filtering by `type` and other header keys doesn't pay for parsing
+    the rest of the discarded manifests.
+
+    If `skip_invalid` is set, manifest files which can't be read or parsed
+    (e.g. those of other software) are skipped and listed in `invalid`
+    instead of raising.
+    """
+
+    def __init__(self, paths, type=None, cache=True, max_depth=None,
+                 ignore=MANIFEST_IGNORE, lazy=False, skip_invalid=False):
 
         if isinstance(paths, basestring):
             self.paths = [paths]
@@ -217,43 +634,259 @@ class ManifestDB(object):
             self.paths = paths
 
         self.type = type
+        self.max_depth = max_depth
+        self.ignore = ignore
+        self.lazy = lazy
+        self.skip_invalid = skip_invalid
+        self.invalid = []
+
+        if cache:
+            self.cache = ManifestCache.get_instance()
+        else:
+            self.cache = None
 
         self.manifests = {}
+        self.hashes = {}
+        self.indexes = dict((key, defaultdict(set)) for key in MANIFEST_INDEXES)
+        # ids of lazily loaded manifests missing from `MANIFEST_BODY_INDEXES`:
+        self.unindexed = set()
 
         self._manifest_scanner = self.scan()
 
+    def discover(self, root):
+        """ Returns a list of all manifest files below `root`. """
+        return list(cream.util.find_files(root, MANIFEST_FILE,
+                                          self.max_depth, self.ignore))
+
     def scan(self):
 
-        for path in self.paths:
-            for file_ in cream.util.walkfiles(os.path.abspath(path)):
-                filename = os.path.split(file_)[1]
-                if filename == MANIFEST_FILE:
-                    manifest = Manifest(file_)
-                    if not self.type or manifest['type'] == self.type:
-                        self.manifests[manifest['id']] = manifest
-                        yield manifest
+        roots = [os.path.abspath(path) for path in self.paths]
+        seen = set()
+
+        if len(roots) > 1:
+            # Walk all roots concurrently, handling them in order.
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(len(roots), MAX_SCAN_THREADS))
+            discovered = pool.imap(self.discover, roots)
+            pool.close()
+        else:
+            discovered = map(self.discover, roots)
+
+        for files in discovered:
+            for file_ in files:
+                seen.add(file_)
+                try:
+                    manifest, hash = self._load(file_)
+                except (Exception, ManifestException, NoNamespaceDefinedException):
+                    if not self.skip_invalid:
+                        raise
+                    self.invalid.append(file_)
+                    continue
+                if not self.type or manifest['type'] == self.type:
+                    self._add(manifest, hash)
+                    yield manifest
+
+        if self.cache is not None:
+            self.cache.prune(roots, seen)
+            self.cache.save()
+
+    def _load(self, path):
+        """
+        Load the manifest at `path`, taking it from the cache if the file
+        didn't change since it was cached. Returns a `(manifest, hash)`
+        tuple.
+        """
+
+        if self.cache is None:
+            return Manifest(path, lazy=self.lazy), content_hash(path)
+
+        stamp = stat_stamp(path)
+        cached = self.cache.get(path, stamp)
+        if cached is not None:
+            data, hash = cached
+            # Entries written by lazy databases may lack all but the header.
+            if self.lazy or 'licenses' in data:
+                return Manifest.fromdict(path, data), hash
+
+        manifest = Manifest(path, lazy=self.lazy)
+        hash = content_hash(path)
+        self.cache.set(path, stamp, manifest.todict(), hash)
+        return manifest, hash
+
+
+    def _add(self, manifest, hash):
+
+        id = manifest['id']
+        if id in self.manifests:
+            self._remove(id)
+
+        self.manifests[id] = manifest
+        self.hashes[id] = hash
+        for key in MANIFEST_INDEXES:
+            if manifest.loaded or key not in MANIFEST_BODY_INDEXES:
+                self._index(key, manifest, hash)
+        if not manifest.loaded:
+            self.unindexed.add(id)
+
+    def _index(self, key, manifest, hash):
+        index = self.indexes[key]
+        for value in MANIFEST_INDEXES[key](manifest, hash):
+            index[value].add(manifest['id'])
+
+    def _index_bodies(self, ids):
+        """ Add the manifests in `ids` to `MANIFEST_BODY_INDEXES`, if missing. """
+        for id in self.unindexed.intersection(ids):
+            self.unindexed.remove(id)
+            for key in MANIFEST_BODY_INDEXES:
+                self._index(key, self.manifests[id], self.hashes[id])
+
+    def _remove(self, id):
+
+        manifest = self.manifests.pop(id)
+        hash = self.hashes.pop(id)
+        for key, get_keys in MANIFEST_INDEXES.iteritems():
+            if id in self.unindexed and key in MANIFEST_BODY_INDEXES:
+                continue
+            index = self.indexes[key]
+            for value in get_keys(manifest, hash):
+                ids = index.get(value)
+                if ids is not None:
+                    ids.discard(id)
+                    if not ids:
+                        del index[value]
+        self.unindexed.discard(id)
+
+        return manifest
+
+
+    def _query(self, kwargs):
+        """
+        Returns the ids of all loaded manifests matching `kwargs`. Indexed
+        keys are looked up from their index and the hits intersected;
+        remaining keys are compared against the manifests left over.
+        """
+
+        ids = None
+        filters = {}
+
+        # Keys in `MANIFEST_BODY_INDEXES` come last, so only the candidates
+        # left at that point have to be loaded if they are lazy.
+        keys = sorted(kwargs, key=lambda key: key in MANIFEST_BODY_INDEXES)
+
+        for key in keys:
+            value = kwargs[key]
+            if key in MANIFEST_BODY_INDEXES and self.unindexed:
+                self._index_bodies(self.manifests if ids is None else ids)
+
+            if key == 'id':
+                hits = set((value,)) if value in self.manifests else set()
+            elif key in self.indexes:
+                hits = self.indexes[key].get(value, set())
+            else:
+                filters[key] = value
+                continue
+
+            if ids is None:
+                ids = set(hits)
+            else:
+                ids &= hits
+            if not ids:
+                return ids
+
+        if ids is None:
+            ids = set(self.manifests)
+
+        if filters:
+            ids = set(id for id in ids if self._matches(self.manifests[id], filters))
+
+        return ids
+
+    def _matches(self, manifest, kwargs):
+
+        for key, value in kwargs.iteritems():
+            if key in MANIFEST_INDEXES:
+                hash = self.hashes[manifest['id']]
+                if value not in MANIFEST_INDEXES[key](manifest, hash):
+                    return False
+            elif manifest.get(key, None) != value:
+                return False
+        return True
 
 
     def get(self, **kwargs):
+        """
+        Returns a manifest matching all of the given keyword arguments or
+        `None`. Only scans for more manifests if none of the already loaded
+        manifests matches.
 
-        if 'id' in kwargs and kwargs['id'] in self.manifests:
-            return self.manifests[kwargs['id']]
+        Besides any manifest key, the indexed keys `name`, `type`,
+        `provides` (a provided component type), `category` (a category id)
+        and `hash` (the manifest file's content hash) may be queried.
+        """
 
-        for manifest in self.manifests.itervalues():
-            for key, value in kwargs.iteritems():
-                if manifest.get(key, None) == value:
-                    return manifest
+        for id in self._query(kwargs):
+            return self.manifests[id]
 
         for manifest in self._manifest_scanner:
-            for key, value in kwargs.iteritems():
-                if manifest.get(key, None) == value:
-                    return manifest
+            if self._matches(manifest, kwargs):
+                # The scan stops here, save what it parsed so far.
+                if self.cache is not None:
+                    self.cache.save()
+                return manifest
+
+    def get_by_hash(self, hash):
+        return self.get(hash=hash)
+
+    def find(self, **kwargs):
+        """ Returns a list of all manifests matching the keyword arguments. """
+
+        self.load_all()
+        return [self.manifests[id] for id in self._query(kwargs)]
 
     def get_all(self):
 
-        # load all manifests
+        self.load_all()
+        return self.manifests.values()
+
+    def load_all(self):
+
         for manifest in self._manifest_scanner:
             pass
 
-        return self.manifests.values()
+    @property
+    def by_name(self):
+        """ Dictionary mapping names to manifests. """
+
+        self.load_all()
+        return dict((name, self.manifests[id])
+                    for name, ids in self.indexes['name'].iteritems()
+                    for id in ids)
+
+
+def main(args=None):
+    """
+    Compile all manifests found below the directories given on the
+    command line, e.g. at install time.
+    """
+
+    if args is None:
+        args = sys.argv[1:]
+
+    if not args:
+        print >> sys.stderr, "Usage: cream-compile-manifests DIRECTORY..."
+        return 2
+
+    status = 0
+    for directory in args:
+        for path in cream.util.find_files(os.path.abspath(directory),
+                                          MANIFEST_FILE, ignore=MANIFEST_IGNORE):
+            try:
+                compile_manifest(path)
+            except (Exception, ManifestException, NoNamespaceDefinedException), err:
+                print >> sys.stderr, "Could not compile %s: %s" % (path, err)
+                status = 1
+    return status
+
 
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# Copyright: 2007-2013, Sebastian Billaudelle <sbillaudelle@googlemail.com>
+#            2010-2013, Kristoffer Kleine <kris.kleine@yahoo.de>
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import sys
+import signal
+import traceback
+
+from cream.util import cached_property
+from cream.util import unique
+from cream.util import trace
+
+from cream.base import Component
+from cream.features import finalize_features_concurrently
+from cream.path import find_module_manifest
+
+class Module(Component, unique.UniqueApplication):
+    """
+    This is the baseclass for every Cream module. It bundles features
+    you would need within your application or service, such as:
+
+     - an GObject mainloop,
+     - logging capabilities,
+     - and meta data handling.
+
+    """
+
+    # Seconds `quit` waits for features to be finalized:
+    shutdown_timeout = 5.0
+    # Finalizers taking longer than this many seconds are reported:
+    slow_finalizer_threshold = 0.5
+
+    def __init__(self, module_id, module_name='', *args, **kwargs):
+
+        with trace.phase('manifest probing', id=module_id):
+            manifest_path = find_module_manifest(module_id, module_name)
+
+        Component.__init__(self, manifest_path, *args, **kwargs)
+        unique.UniqueApplication.__init__(self, module_id)
+
+
+    def main(self, enable_threads=True):
+        """
+        Run a GObject-mainloop.
+
+        :param enable_threads: Whether to enable GObjects threading
+                               capabilities. This can have negative
+                               impact on some applications. Please use
+                               with care!
+        :type enable_threads: `bool`
+        """
+
+        signal.signal(signal.SIGTERM, self.signal_cb)
+
+        from gi.repository import GObject as gobject
+
+        if enable_threads:
+            gobject.threads_init()
+
+        self._mainloop = gobject.MainLoop()
+        trace.TRACER.finish()
+        try:
+            self._mainloop.run()
+        except (SystemError, KeyboardInterrupt):
+            # shut down gracefully.
+            self.quit()
+
+
+    @cached_property
+    def messages(self):
+        from cream.log import Messages
+        return Messages(id=self.context.manifest['id'])
+
+
+    def signal_cb(self, signal, frame):
+        if signal == signal.SIGTERM:
+            self.quit()
+
+
+    def quit(self):
+        """ Quit the mainloop and exit the application. """
+
+        self.messages.debug("Shutting down quietly. Protesting wouldn't make sense. I'm just a machine. Grrrrmmm.")
+
+        try:
+            # __finalize__ all registered features:
+            report = finalize_features_concurrently(self._features, self.shutdown_timeout)
+            for feature, duration, error in report:
+                name = type(feature).__name__
+                if error is not None:
+                    self.messages.error("Finalizing %s failed:\n%s" % (
+                        name, ''.join(traceback.format_exception(*error))))
+                elif duration is None:
+                    self.messages.warning("%s wasn't finalized within %.1f seconds." % (
+                        name, self.shutdown_timeout))
+                elif duration > self.slow_finalizer_threshold:
+                    self.messages.warning("Finalizing %s took %.2f seconds." % (name, duration))
+        finally:
+            unique.UniqueApplication.quit(self)
+            # Only modules which used IPC have a bus name to release.
+            if 'cream.ipc' in sys.modules:
+                sys.modules['cream.ipc'].release_bus_names()
+            self._mainloop.quit()
@@ -0,0 +1,185 @@
+# Copyright: 2007-2013, Sebastian Billaudelle <sbillaudelle@googlemail.com>
+#            2010-2013, Kristoffer Kleine <kris.kleine@yahoo.de>
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+
+from gi.repository import GObject as gobject, Gio as gio
+
+from cream.util import walk_directories, get_ignore_matcher
+
+from .manifest import (ManifestDB, ManifestException, NoNamespaceDefinedException,
+                       MANIFEST_FILE, stat_stamp)
+
+
+class LiveManifestDB(gobject.GObject, ManifestDB):
+    """
+    A `ManifestDB` which watches its `paths` for changes using GIO file
+    monitors (backed by inotify on Linux).
+
+    Only manifest files which actually changed are parsed again. Indexes
+    are kept up to date and the `manifest-added`, `manifest-changed` and
+    `manifest-removed` signals are emitted with the affected manifest.
+    Requires a running GObject mainloop.
+    """
+
+    __gtype_name__ = 'LiveManifestDB'
+    __gsignals__ = {
+        'manifest-added': (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        'manifest-changed': (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+        'manifest-removed': (gobject.SIGNAL_RUN_LAST, gobject.TYPE_NONE, (gobject.TYPE_PYOBJECT,)),
+    }
+
+    def __init__(self, paths, type=None, **kwargs):
+
+        gobject.GObject.__init__(self)
+        ManifestDB.__init__(self, paths, type, **kwargs)
+
+        self.files = {}     # { manifest file: id }
+        self.stamps = {}    # { manifest file: stat stamp }
+        self.monitors = {}  # { directory: gio.FileMonitor }
+        self._is_ignored = get_ignore_matcher(self.ignore)
+
+        self.load_all()
+
+        for path in self.paths:
+            self._add_tree(os.path.abspath(path))
+
+
+    def _load(self, path):
+        # Only recorded once parsed, so a file failing to parse is tried
+        # again on its next change.
+        stamp = stat_stamp(path)
+        result = ManifestDB._load(self, path)
+        self.stamps[path] = stamp
+        return result
+
+    def _add(self, manifest, hash):
+        ManifestDB._add(self, manifest, hash)
+        self.files[os.path.join(manifest['path'], MANIFEST_FILE)] = manifest['id']
+
+    def _remove(self, id):
+        manifest = ManifestDB._remove(self, id)
+        path = os.path.join(manifest['path'], MANIFEST_FILE)
+        if self.files.get(path) == id:
+            del self.files[path]
+        return manifest
+
+
+    def _get_depth(self, path):
+        """
+        Returns the number of levels `path` is below the watched path
+        containing it, or `None` if `scan` wouldn't enter it because of
+        `max_depth` or `ignore`.
+        """
+
+        for root in self.paths:
+            root = os.path.abspath(root)
+            if path == root:
+                return 0
+            if path.startswith(os.path.join(root, '')):
+                names = os.path.relpath(path, root).split(os.sep)
+                if self.max_depth is not None and len(names) > self.max_depth:
+                    return None
+                if any(self._is_ignored(name) for name in names):
+                    return None
+                return len(names)
+        return None
+
+    def _add_tree(self, root):
+        """
+        Watch `root` and its subdirectories, loading new manifests. The
+        directories are walked like `scan` does, honouring `max_depth` and
+        `ignore`.
+        """
+
+        depth = self._get_depth(root)
+        if depth is None:
+            return
+        if self.max_depth is not None:
+            max_depth = self.max_depth - depth
+        else:
+            max_depth = None
+
+        for directory, _, files in walk_directories(root, max_depth, self.ignore):
+            if directory not in self.monitors:
+                monitor = gio.File.new_for_path(directory).monitor_directory(
+                    gio.FileMonitorFlags.NONE, None)
+                monitor.connect('changed', self.directory_changed_cb)
+                self.monitors[directory] = monitor
+            if MANIFEST_FILE in files:
+                self._update(os.path.join(directory, MANIFEST_FILE))
+
+    def _remove_tree(self, root):
+        """ Stop watching `root` and drop all manifests found below it. """
+
+        prefix = os.path.join(root, '')
+
+        for directory in self.monitors.keys():
+            if directory == root or directory.startswith(prefix):
+                self.monitors.pop(directory).cancel()
+
+        for path in self.stamps.keys():
+            if path == root or path.startswith(prefix):
+                del self.stamps[path]
+                if path in self.files:
+                    self.emit('manifest-removed', self._remove(self.files[path]))
+
+        if self.cache is not None:
+            self.cache.prune([root], ())
+            self.cache.save()
+
+    def _update(self, path):
+        """ Reload the manifest at `path` if it changed since the last load. """
+
+        try:
+            if self.stamps.get(path) == stat_stamp(path):
+                return
+            manifest, hash = self._load(path)
+        except (Exception, ManifestException, NoNamespaceDefinedException):
+            # Probably a half-written file; we'll get another event once
+            # writing is done.
+            return
+
+        old_id = self.files.get(path)
+        if old_id is not None and (old_id != manifest['id'] or
+                                   (self.type and manifest['type'] != self.type)):
+            self.emit('manifest-removed', self._remove(old_id))
+            old_id = None
+
+        if not self.type or manifest['type'] == self.type:
+            self._add(manifest, hash)
+            if old_id is None:
+                self.emit('manifest-added', manifest)
+            else:
+                self.emit('manifest-changed', manifest)
+
+        if self.cache is not None:
+            self.cache.save()
+
+
+    def directory_changed_cb(self, monitor, file_, other_file, event):
+
+        path = file_.get_path()
+
+        if event == gio.FileMonitorEvent.DELETED:
+            self._remove_tree(path)
+        elif event in (gio.FileMonitorEvent.CREATED,
+                       gio.FileMonitorEvent.CHANGES_DONE_HINT):
+            if os.path.isdir(path):
+                self._add_tree(path)
+            elif os.path.basename(path) == MANIFEST_FILE:
+                self._update(path)
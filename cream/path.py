@@ -16,6 +16,7 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
 import os
+import marshal
 
 try:
     XDG_DATA_DIRS = os.environ['XDG_DATA_DIRS'].split(':')
@@ -25,9 +26,14 @@ try:
     XDG_DATA_HOME = os.environ['XDG_DATA_HOME'].split(':')
 except KeyError:
     XDG_DATA_HOME = [os.path.expanduser('~/.local/share')]
+try:
+    XDG_CACHE_HOME = os.environ['XDG_CACHE_HOME']
+except KeyError:
+    XDG_CACHE_HOME = os.path.expanduser('~/.cache')
 
 CREAM_DATA_DIR = XDG_DATA_DIRS[0]
 CREAM_DATA_HOME = XDG_DATA_HOME[0]
+CREAM_CACHE_HOME = os.path.join(XDG_CACHE_HOME, 'cream')
 
 CREAM_DATA_DIRS = XDG_DATA_DIRS + XDG_DATA_HOME
 
@@ -37,3 +43,92 @@ if virtual_env:
     VIRTUALENV_DATA_HOME = os.path.join(virtual_env, 'share/')
     CREAM_DATA_DIRS.append(VIRTUALENV_DATA_HOME)
 
+# Set `CREAM_PATH_CACHE=1` to persist manifest lookups across processes:
+PATH_CACHE_FILE = os.path.join(CREAM_CACHE_HOME, 'paths.cache')
+PERSISTENT_PATH_CACHE = os.environ.get('CREAM_PATH_CACHE') == '1'
+
+_manifest_paths = None
+_created_directories = set()
+
+
+def _get_data_dir_stamps():
+    stamps = []
+    for directory in CREAM_DATA_DIRS:
+        try:
+            stamps.append(os.stat(directory).st_mtime)
+        except OSError:
+            stamps.append(None)
+    return stamps
+
+def _load_manifest_paths():
+
+    if not PERSISTENT_PATH_CACHE:
+        return {}
+
+    try:
+        with open(PATH_CACHE_FILE, 'rb') as f:
+            data_dirs, stamps, paths = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return {}
+
+    # Installing or removing a module changes the mtime of its data directory.
+    if data_dirs != CREAM_DATA_DIRS or stamps != _get_data_dir_stamps():
+        return {}
+    return paths
+
+def _save_manifest_paths():
+
+    if not PERSISTENT_PATH_CACHE:
+        return
+
+    tmp_path = '%s.%d' % (PATH_CACHE_FILE, os.getpid())
+    try:
+        ensure_directory(os.path.dirname(PATH_CACHE_FILE))
+        with open(tmp_path, 'wb') as f:
+            marshal.dump((CREAM_DATA_DIRS, _get_data_dir_stamps(), _manifest_paths), f)
+        os.rename(tmp_path, PATH_CACHE_FILE)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def find_module_manifest(module_id, module_name=''):
+    """
+    Returns the path of the manifest of the module identified by
+    `module_id` or `module_name` in `CREAM_DATA_DIRS` (later directories
+    taking precedence), or an empty string if there is none.
+
+    Results, including unsuccessful lookups, are cached for the lifetime
+    of the process and, if `PERSISTENT_PATH_CACHE` is set, on disk.
+    """
+
+    global _manifest_paths
+    if _manifest_paths is None:
+        _manifest_paths = _load_manifest_paths()
+
+    key = '%s:%s' % (module_id, module_name)
+    manifest_path = _manifest_paths.get(key)
+    if manifest_path is not None and (not manifest_path or os.path.exists(manifest_path)):
+        return manifest_path
+
+    manifest_path = ''
+    for directory in reversed(CREAM_DATA_DIRS):
+        for sub_dir in (module_id, module_name):
+            path = os.path.join(directory, sub_dir, 'manifest.xml')
+            if os.path.exists(path):
+                manifest_path = path
+                break
+        if manifest_path:
+            break
+
+    _manifest_paths[key] = manifest_path
+    _save_manifest_paths()
+    return manifest_path
+
+def ensure_directory(path):
+    """ Create the directory `path` unless it was created or found before. """
+
+    if path not in _created_directories:
+        if not os.path.exists(path):
+            os.makedirs(path)
+        _created_directories.add(path)
@@ -37,6 +37,106 @@ def walkfiles(*args, **kwargs):
         for file_ in files:
             yield os.path.join(directory, file_)
 
+def _scan_directory(directory):
+    """
+    Returns a list of `(name, is_directory)` tuples for the entries of
+    `directory`. Symbolic links to directories are not considered
+    directories, just like `os.walk` does by default.
+    """
+    import os
+    try:
+        scandir = os.scandir
+    except AttributeError:
+        try:
+            from scandir import scandir
+        except ImportError:
+            scandir = None
+
+    if scandir is not None:
+        # Directory entries carry their type, so no `stat` calls needed.
+        return [(entry.name, entry.is_dir(follow_symlinks=False))
+                for entry in scandir(directory)]
+    else:
+        result = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            result.append((name, os.path.isdir(path) and not os.path.islink(path)))
+        return result
+
+def walk_directories(root, max_depth=None, ignore=()):
+    """
+    Yields a `(directory, depth, files)` tuple for `root` and each of its
+    subdirectories, `depth` being the number of levels below `root` and
+    `files` the names of the files in the directory.
+
+    Subdirectories whose name matches one of the shell-style patterns in
+    `ignore` are not entered, neither are directories more than
+    `max_depth` levels below `root`.
+    """
+    import os
+
+    is_ignored = get_ignore_matcher(ignore)
+
+    stack = [(root, 0)]
+    while stack:
+        directory, depth = stack.pop()
+        try:
+            entries = _scan_directory(directory)
+        except OSError:
+            continue
+        files = []
+        for name, is_directory in entries:
+            if is_directory:
+                if (max_depth is None or depth < max_depth) and not is_ignored(name):
+                    stack.append((os.path.join(directory, name), depth + 1))
+            else:
+                files.append(name)
+        yield directory, depth, files
+
+def get_ignore_matcher(ignore):
+    """
+    Returns a function telling whether a name matches one of the
+    shell-style patterns in `ignore`.
+    """
+    import re
+    from fnmatch import translate
+
+    if ignore:
+        return re.compile('|'.join(translate(p) for p in ignore)).match
+    return lambda name: False
+
+def find_files(root, filename, max_depth=None, ignore=()):
+    """
+    Yields the paths of all files named `filename` below `root`, walking
+    the directories like `walk_directories`.
+    """
+    import os
+
+    for directory, depth, files in walk_directories(root, max_depth, ignore):
+        if filename in files:
+            yield os.path.join(directory, filename)
+
+def atomic_write(path, data):
+    """
+    Write `data` to the file at `path` so it contains either its old or its
+    new content at any time, even after a crash: `data` is written to a
+    temporary file, which is synced to disk and renamed to `path`.
+    """
+    import os
+    import thread
+
+    tmp_path = '%s.%d-%d.tmp' % (path, os.getpid(), thread.get_ident())
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
 def urljoin_multi(*parts):
     """
     Joins multiple strings into an url using a slash ('/'). Example::
@@ -0,0 +1,150 @@
+# Copyright: 2007-2013, Sebastian Billaudelle <sbillaudelle@googlemail.com>
+#            2010-2013, Kristoffer Kleine <kris.kleine@yahoo.de>
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+    Startup tracing
+    ---------------
+
+    Set the `CREAM_TRACE_STARTUP` environment variable to record how long
+    the phases of a module's startup take. With a value of `1` the report
+    is printed to stderr once the mainloop starts, any other value but
+    `0` and `false` is taken as the path of a JSON file to write it to.
+"""
+
+import os
+import sys
+import json
+import time
+import ctypes
+import threading
+from contextlib import contextmanager
+
+TRACE_ENVIRON = 'CREAM_TRACE_STARTUP'
+# Values of `TRACE_ENVIRON` which disable tracing, like leaving it unset:
+DISABLED_VALUES = ('', '0', 'false')
+# Values of `TRACE_ENVIRON` which print the report to stderr:
+STDERR_VALUES = ('1', 'stderr')
+
+CLOCK_MONOTONIC = 1
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+try:
+    _clock_gettime = ctypes.CDLL(None, use_errno=True).clock_gettime
+    _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+except AttributeError:
+    _clock_gettime = None
+
+def monotonic():
+    """ Returns the time of a monotonic clock in seconds. """
+    if _clock_gettime is None:
+        return time.time()
+    t = timespec()
+    if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+        return time.time()
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+
+class StartupTracer(object):
+
+    def __init__(self, destination=None):
+
+        self.enabled = destination is not None and destination.lower() not in DISABLED_VALUES
+        if self.enabled and destination not in STDERR_VALUES:
+            # Modules change into their directory while starting up.
+            destination = os.path.abspath(destination)
+        self.destination = destination
+        self.finished = False
+
+        self.start = monotonic()
+        self.phases = []
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+
+    @contextmanager
+    def phase(self, name, **info):
+        """ Record the time spent in the `with` block as phase `name`. """
+
+        if not self.enabled:
+            yield
+            return
+
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+
+        entry = {
+            'name'   : name,
+            'info'   : info,
+            'thread' : threading.current_thread().name,
+            'depth'  : depth,
+            'start'  : monotonic() - self.start,
+        }
+        try:
+            yield
+        finally:
+            entry['duration'] = monotonic() - self.start - entry['start']
+            self._local.depth = depth
+            with self._lock:
+                self.phases.append(entry)
+
+
+    def get_report(self):
+
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase['start'])
+
+        return {
+            'pid'    : os.getpid(),
+            'argv'   : sys.argv,
+            'total'  : monotonic() - self.start,
+            'phases' : phases,
+        }
+
+    def finish(self):
+        """ Write the report, once the startup is done. """
+
+        if not self.enabled or self.finished:
+            return
+        self.finished = True
+
+        report = self.get_report()
+
+        if self.destination in STDERR_VALUES:
+            for phase in report['phases']:
+                info = ', '.join('%s=%s' % item for item in sorted(phase['info'].items()))
+                sys.stderr.write('[startup] %8.2f ms  %8.2f ms  %s%s%s\n' % (
+                    phase['start'] * 1000, phase['duration'] * 1000,
+                    '  ' * phase['depth'], phase['name'], info and ' (%s)' % info))
+            sys.stderr.write('[startup] %8.2f ms  total\n' % (report['total'] * 1000))
+        else:
+            try:
+                with open(self.destination, 'w') as f:
+                    json.dump(report, f, indent=2)
+            except IOError, err:
+                sys.stderr.write('Could not write startup trace: %s\n' % err)
+
+
+TRACER = StartupTracer(os.environ.get(TRACE_ENVIRON))
+
+def phase(name, **info):
+    return TRACER.phase(name, **info)
+
+def get_report():
+    return TRACER.get_report()
@@ -37,6 +37,7 @@ from lxml import etree
 from gi.repository import GObject as gobject, GLib as glib
 
 from cream.util.xmlserialize import serialize, unserialize
+from cream.util import trace
 
 SOCKET_TEMPLATE = os.path.expanduser('~/.local/var/run/cream/%s.sock')
 PONG_TIMEOUT = 100 # = 100 ms.
@@ -48,8 +49,9 @@ class UniqueApplication(gobject.GObject):
         self._setup_unique()
 
     def _setup_unique(self):
-        self._unique_manager = UniqueManager.get(self, self._ident)
-        self._unique_manager.run() # TODO
+        with trace.phase('unique handshake', ident=self._ident):
+            self._unique_manager = UniqueManager.get(self, self._ident)
+            self._unique_manager.run() # TODO
 
     def _replace_server(self):
         """
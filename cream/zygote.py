@@ -0,0 +1,305 @@
+# Copyright: 2007-2013, Sebastian Billaudelle <sbillaudelle@googlemail.com>
+#            2010-2013, Kristoffer Kleine <kris.kleine@yahoo.de>
+
+# This library is free software; you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation; either version 2.1 of the License, or
+# (at your option) any later version.
+
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU Lesser General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+    Zygote
+    ------
+
+    A process which imports everything cream modules need and parses all
+    module manifests once, then forks a child for every module it is asked
+    to launch. The child runs the module's `exec` script, so launching a
+    module costs about a fork instead of a cold interpreter start, and the
+    preloaded pages are shared copy-on-write.
+
+    Requests are single lines of JSON sent over a UNIX socket:
+
+        {"id": "org.cream.Melange", "argv": [], "cwd": "/", "env": {...}}
+
+    and answered with `{"pid": 1234}` or `{"error": "..."}`.
+"""
+
+import os
+import sys
+import json
+import errno
+import signal
+import socket
+import traceback
+
+from cream.manifest import ManifestDB
+from cream.path import CREAM_DATA_DIRS, find_module_manifest, ensure_directory
+from cream.util import trace
+
+ZYGOTE_SOCKET = os.environ.get('CREAM_ZYGOTE_SOCKET',
+                               os.path.expanduser('~/.local/var/run/cream/zygote.sock'))
+
+# Imported before forking. Gtk is left out on purpose, importing it opens
+# a display connection which must not be shared between processes.
+PRELOAD_MODULES = (
+    'lxml.etree',
+    'gi.repository.GObject',
+    'gi.repository.GLib',
+    'gi.repository.Gio',
+    'dbus',
+    'dbus.service',
+    'gpyconf',
+    'cream.module',
+    'cream.ipc',
+    'cream.config',
+)
+
+# Seconds a client may take to send its request. Requests are served one
+# at a time, so a stuck client must not block other launches for long.
+REQUEST_TIMEOUT = 2.0
+
+# Environment variables module level constants of cream are derived from
+# (see `cream.path`, `cream.config.backend` and `cream.util.unique`) when
+# they are preloaded. Requests with different values are refused, the
+# children would use the zygote's values.
+ENVIRONMENT_DEPENDENT = (
+    'HOME',
+    'XDG_DATA_DIRS',
+    'XDG_DATA_HOME',
+    'XDG_CACHE_HOME',
+    'VIRTUAL_ENV',
+    'CREAM_PATH_CACHE',
+    'CREAM_SCHEME_CACHE',
+)
+
+class ZygoteError(Exception):
+    pass
+
+
+class Zygote(object):
+
+    def __init__(self, socket_path=ZYGOTE_SOCKET, paths=CREAM_DATA_DIRS):
+
+        self.socket_path = socket_path
+        self.paths = paths
+        self.socket = None
+        self.db = None
+
+    def preload(self):
+        """ Import `PRELOAD_MODULES` and load all module manifests. """
+
+        for module in PRELOAD_MODULES:
+            try:
+                __import__(module)
+            except ImportError:
+                pass
+
+        self.load_manifests()
+
+        # Warm the lookup `cream.Module` does in the children.
+        for id in self.db.manifests:
+            find_module_manifest(id)
+
+    def load_manifests(self):
+        """ Load all module manifests, skipping those which can't be parsed. """
+
+        self.db = ManifestDB(self.paths, max_depth=1, skip_invalid=True)
+        self.db.load_all()
+        for path in self.db.invalid:
+            print >> sys.stderr, "Skipping invalid manifest %s" % path
+
+    def get_manifest(self, module_id):
+
+        manifest = self.db.manifests.get(module_id)
+        if manifest is None:
+            # The module might have been installed after we started.
+            self.load_manifests()
+            manifest = self.db.manifests.get(module_id)
+        return manifest
+
+    def listen(self):
+
+        ensure_directory(os.path.dirname(self.socket_path))
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(self.socket_path)
+        self.socket.listen(16)
+
+    def run(self):
+        """ Preload, then serve requests until interrupted. """
+
+        self.preload()
+        self.listen()
+
+        # Let the kernel reap our children.
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+        try:
+            while True:
+                try:
+                    conn = self.socket.accept()[0]
+                except socket.error, err:
+                    if err.errno == errno.EINTR:
+                        continue
+                    raise
+                try:
+                    self.handle(conn)
+                except socket.error:
+                    # The client went away early or timed out
+                    # (`socket.timeout` is a `socket.error`).
+                    pass
+                except Exception:
+                    traceback.print_exc()
+                finally:
+                    conn.close()
+        finally:
+            self.socket.close()
+            os.remove(self.socket_path)
+
+    def handle(self, conn):
+
+        conn.settimeout(REQUEST_TIMEOUT)
+        try:
+            request = json.loads(conn.makefile('r').readline())
+            manifest = self.get_manifest(request['id'])
+            if manifest is None:
+                raise ZygoteError("No such module: %s" % request['id'])
+            if not manifest['exec']:
+                raise ZygoteError("Module %s has no executable" % request['id'])
+            check_environment(request.get('env', {}))
+        except (ValueError, KeyError, ZygoteError), err:
+            conn.sendall(json.dumps({'error': str(err)}) + '\n')
+            return
+
+        try:
+            pid = os.fork()
+        except OSError, err:
+            conn.sendall(json.dumps({'error': str(err)}) + '\n')
+            return
+
+        if pid == 0:
+            conn.close()
+            self.socket.close()
+            run_child(manifest, request)
+
+        conn.sendall(json.dumps({'pid': pid}) + '\n')
+
+
+def check_environment(env):
+    """ Raise `ZygoteError` if `env` differs in `ENVIRONMENT_DEPENDENT`. """
+
+    for key in ENVIRONMENT_DEPENDENT:
+        value = env.get(key)
+        if value is not None:
+            value = value.encode('utf-8')
+        if value != os.environ.get(key):
+            raise ZygoteError("Can't launch with a different %s than the zygote's, "
+                              "start the module directly instead" % key)
+
+
+def run_child(manifest, request):
+    """ Run the module described by `manifest` in a forked child. Never returns. """
+
+    status = 1
+    try:
+        os.setsid()
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        os.environ.clear()
+        os.environ.update((key.encode('utf-8'), value.encode('utf-8'))
+                          for key, value in request.get('env', {}).iteritems())
+        os.chdir(request.get('cwd', manifest['path']))
+
+        import random
+        random.seed()
+        trace.TRACER = trace.StartupTracer(os.environ.get(trace.TRACE_ENVIRON))
+
+        path = os.path.join(manifest['path'], manifest['exec'])
+        sys.argv = [path] + [arg.encode('utf-8') for arg in request.get('argv', ())]
+        sys.path[0] = os.path.dirname(path)
+
+        import runpy
+        try:
+            runpy.run_path(path, run_name='__main__')
+            status = 0
+        except SystemExit, exc:
+            if exc.code is None or isinstance(exc.code, int):
+                status = exc.code or 0
+            else:
+                print >> sys.stderr, exc.code
+    except:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+
+def launch(module_id, argv=(), socket_path=ZYGOTE_SOCKET):
+    """
+    Ask the zygote listening at `socket_path` to launch `module_id` with
+    the arguments `argv` and the current working directory and
+    environment. Returns the pid of the new process.
+    """
+
+    request = {
+        'id'   : module_id,
+        'argv' : list(argv),
+        'cwd'  : os.getcwd(),
+        'env'  : dict(os.environ),
+    }
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request) + '\n')
+            response = json.loads(sock.makefile('r').readline())
+        except (socket.error, ValueError), err:
+            raise ZygoteError("Could not talk to the zygote: %s" % err)
+    finally:
+        sock.close()
+
+    if 'error' in response:
+        raise ZygoteError(response['error'])
+    return response['pid']
+
+
+def main(args=None):
+    """
+    `cream-zygote` runs the zygote, `cream-zygote MODULE_ID [ARGS...]`
+    launches a module using it.
+    """
+
+    if args is None:
+        args = sys.argv[1:]
+
+    if not args:
+        try:
+            Zygote().run()
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    try:
+        print launch(args[0], args[1:])
+    except ZygoteError, err:
+        print >> sys.stderr, err
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
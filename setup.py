@@ -14,5 +14,6 @@ setup(
         'cream.xdg',
         'cream.xdg.desktopentries'
     ],
-    package_data={'cream.config': ['interface/*']}
+    package_data={'cream.config': ['interface/*']},
+    scripts=['scripts/cream-compile-manifests', 'scripts/cream-zygote']
 )